@@ -0,0 +1,301 @@
+import json
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import settings
+from llm_client import (
+    LLMError,
+    _cache_key,
+    _cached_response,
+    _client,
+    _completion_kwargs,
+    _safe_parse_json,
+    _store_response,
+)
+
+# Terminal states of an OpenAI batch; everything else is still running
+_DONE = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchPending(Exception):
+    """The prompt has no answer yet; it was queued for the next batch job."""
+
+
+# ========================
+# PROVIDERS
+# ========================
+class BatchProvider(ABC):
+    """
+    Runs a JSONL file of chat completion requests (OpenAI batch format:
+    custom_id, method, url, body) as one job.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def submit(self, path: str) -> str:
+        """Starts a job for the requests in `path`; returns its id."""
+
+    @abstractmethod
+    def status(self, job_id: str) -> str:
+        """Provider status; the job is finished once it is in _DONE."""
+
+    @abstractmethod
+    def results(self, job_id: str) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        """custom_id -> (message content, error) of a finished job."""
+
+    @staticmethod
+    def parse_output(lines: List[str]) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        results = {}
+        for line in lines:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            response = row.get("response") or {}
+            if row.get("error") or response.get("status_code") != 200:
+                error = row.get("error") or (response.get("body") or {}).get("error") or response.get("status_code")
+                results[row["custom_id"]] = (None, str(error))
+            else:
+                results[row["custom_id"]] = (response["body"]["choices"][0]["message"]["content"], None)
+        return results
+
+
+class OpenAIBatchProvider(BatchProvider):
+    """OpenAI Batch API: half the token price, results within LLM_BATCH_COMPLETION_WINDOW."""
+
+    name = "openai"
+
+    def __init__(self, client=None):
+        self.client = client or _client
+
+    def submit(self, path: str) -> str:
+        with open(path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window=settings.LLM_BATCH_COMPLETION_WINDOW,
+        )
+        return batch.id
+
+    def status(self, job_id: str) -> str:
+        return self.client.batches.retrieve(job_id).status
+
+    def results(self, job_id: str) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        batch = self.client.batches.retrieve(job_id)
+        lines = []
+        # Expired / cancelled batches still return the requests that finished
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines += self.client.files.content(file_id).text.splitlines()
+        return self.parse_output(lines)
+
+
+class LocalBatchProvider(BatchProvider):
+    """
+    Runs the job in-process at submit time, one request after another, and
+    writes its output next to the input in the OpenAI output format.
+    `respond(body) -> content` defaults to a synchronous chat completion
+    (e.g. an OpenAI-compatible server without a batch endpoint); tests pass
+    a stand-in.
+    """
+
+    name = "local"
+
+    def __init__(self, respond: Optional[Callable[[Dict[str, Any]], str]] = None):
+        self.respond = respond or (lambda body: _client.chat.completions.create(**body).choices[0].message.content)
+
+    def submit(self, path: str) -> str:
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        with open(path, encoding="utf-8") as src, open(self._output(job_id), "w", encoding="utf-8") as out:
+            for line in src:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                row = {"custom_id": request["custom_id"], "response": None, "error": None}
+                try:
+                    content = self.respond(request["body"])
+                    row["response"] = {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}}
+                except Exception as e:
+                    row["error"] = {"message": str(e)}
+                out.write(json.dumps(row) + "\n")
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        return "completed"
+
+    def results(self, job_id: str) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        with open(self._output(job_id), encoding="utf-8") as f:
+            return self.parse_output(f.readlines())
+
+    @staticmethod
+    def _output(job_id: str) -> str:
+        return os.path.join(settings.LLM_BATCH_DIR, f"{job_id}-output.jsonl")
+
+
+_provider: Optional[BatchProvider] = None
+
+
+def get_batch_provider() -> BatchProvider:
+    """Provider selected by LLM_BATCH_PROVIDER, unless one was installed with set_batch_provider()."""
+    global _provider
+    if _provider is None:
+        name = settings.LLM_BATCH_PROVIDER.lower()
+        if name == "openai":
+            _provider = OpenAIBatchProvider()
+        elif name == "local":
+            _provider = LocalBatchProvider()
+        else:
+            raise ValueError(f"Unknown LLM_BATCH_PROVIDER: {settings.LLM_BATCH_PROVIDER}")
+    return _provider
+
+
+def set_batch_provider(provider: Optional[BatchProvider]):
+    """Installs e.g. a LocalBatchProvider with a canned `respond` for tests; None resets."""
+    global _provider
+    _provider = provider
+
+
+# ========================
+# PROMPT COLLECTION
+# ========================
+class BatchCollector:
+    """
+    generate_json stand-in for batch mode. Prompts answered by an earlier
+    job (they land in the response cache) are returned; the rest are queued
+    and raise BatchPending. Prompts a job could not answer raise LLMError.
+    Safe to call from several threads.
+    """
+
+    def __init__(self, failed: Optional[Dict[str, str]] = None):
+        self.failed = failed or {}
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str) -> Dict[str, Any]:
+        kwargs = _completion_kwargs(prompt)
+        key = _cache_key(kwargs)
+        if key in self.failed:
+            raise LLMError(f"Batch request failed: {self.failed[key]}")
+
+        # The cache is how answers get back from the job, whatever LLM_CACHE_ENABLED says
+        cached = _cached_response(kwargs, use_cache=True)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            self.pending[key] = kwargs
+        raise BatchPending(key)
+
+
+# ========================
+# JOBS
+# ========================
+def _jobs_path() -> str:
+    return os.path.join(settings.LLM_BATCH_DIR, "jobs.json")
+
+
+def load_jobs() -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(_jobs_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_jobs(jobs: Dict[str, Dict[str, Any]]):
+    tmp = _jobs_path() + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(jobs, f, indent=2)
+    os.replace(tmp, _jobs_path())
+
+
+def open_jobs(provider: Optional[BatchProvider] = None) -> List[str]:
+    """Submitted jobs whose results were not collected yet (e.g. the last run stopped while polling)."""
+    name = (provider or get_batch_provider()).name
+    return [
+        job_id for job_id, job in load_jobs().items()
+        if job["provider"] == name and not job.get("collected")
+    ]
+
+
+def submit_requests(requests: List[Dict[str, Any]], provider: Optional[BatchProvider] = None) -> str:
+    """Writes chat completion kwargs as a JSONL batch file, submits it and records the job."""
+    provider = provider or get_batch_provider()
+    os.makedirs(settings.LLM_BATCH_DIR, exist_ok=True)
+
+    path = os.path.join(settings.LLM_BATCH_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}-input.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for i, body in enumerate(requests):
+            f.write(json.dumps({
+                "custom_id": f"req-{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }) + "\n")
+
+    job_id = provider.submit(path)
+    jobs = load_jobs()
+    jobs[job_id] = {
+        "provider": provider.name,
+        "input": path,
+        "requests": len(requests),
+        "submitted_at": time.time(),
+        # Lets a job whose input file went missing still fail its requests
+        "keys": [_cache_key(body) for body in requests],
+    }
+    _save_jobs(jobs)
+    return job_id
+
+
+def wait_and_collect(job_id: str, provider: Optional[BatchProvider] = None) -> Dict[str, str]:
+    """
+    Polls every LLM_BATCH_POLL_SECONDS until the job finishes, then stores
+    each answer in the response cache under its request's cache key.
+    Returns {cache key: error} for the requests that failed.
+    Raises TimeoutError after LLM_BATCH_MAX_WAIT_SECONDS; the job stays
+    open and the next run picks it up. A job whose input file is gone is
+    closed with all its requests failed.
+    """
+    provider = provider or get_batch_provider()
+    deadline = time.monotonic() + settings.LLM_BATCH_MAX_WAIT_SECONDS
+
+    status = provider.status(job_id)
+    while status not in _DONE:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Batch {job_id} still {status}; rerun later to resume it")
+        print(f"  ⏳ Batch {job_id}: {status}")
+        time.sleep(settings.LLM_BATCH_POLL_SECONDS)
+        status = provider.status(job_id)
+
+    jobs = load_jobs()
+    try:
+        with open(jobs[job_id]["input"], encoding="utf-8") as f:
+            bodies = {row["custom_id"]: row["body"] for row in map(json.loads, filter(str.strip, f))}
+    except FileNotFoundError:
+        print(f"  ⚠️ Batch {job_id}: input file {jobs[job_id]['input']} is gone, its requests count as failed")
+        failed = {key: f"batch input missing (batch {status})" for key in jobs[job_id].get("keys", [])}
+        jobs[job_id]["collected"] = True
+        _save_jobs(jobs)
+        return failed
+
+    results = provider.results(job_id) if status != "failed" else {}
+    failed = {}
+    for custom_id, body in bodies.items():
+        content, error = results.get(custom_id, (None, f"no result (batch {status})"))
+        if error is None:
+            try:
+                _store_response(body, True, _safe_parse_json(content))
+                continue
+            except LLMError as e:
+                error = str(e)
+        failed[_cache_key(body)] = error
+
+    print(f"  ✓ Batch {job_id} {status}: {len(bodies) - len(failed)} answered, {len(failed)} failed")
+    jobs[job_id]["collected"] = True
+    _save_jobs(jobs)
+    return failed
@@ -1,206 +1,565 @@
-from burr.core import action, State, ApplicationBuilder
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from burr.core import action, default, when, State, ApplicationBuilder
+from sqlalchemy import cast, func, or_, String
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 
 from config import settings
-from database import get_session, PRMetadata, PRReport
-from vector_store import VectorStore
-from llm_client import generate_json
+from database import session_scope, load_pr_files, PRMetadata, PRFile, PRReport
+from vector_store import get_vector_store_service
+from lexical_index import get_lexical_index, path_terms, reciprocal_rank_fusion
+from ingestion.dependencies import affected_files, load_reverse_graph
+from llm_client import generate_json, response_cache_stats
+from batch_client import BatchCollector, BatchPending, open_jobs, submit_requests, wait_and_collect
+from prompt_builder import (
+    build_map_prompt,
+    build_reduce_prompt,
+    build_summary_prompt,
+    count_tokens,
+    format_usage,
+    plan_map_groups,
+)
 from report_generator import ReportGenerator
 
-from burr.core import action, State, ApplicationBuilder
+
+
+# -------------------------------------------------
+# Per-PR fan-out
+# -------------------------------------------------
+def fan_out(
+    stage: str,
+    fn: Callable[[Dict[str, Any]], Any],
+    prs: List[Dict[str, Any]],
+    max_workers: int | None = None,
+) -> Tuple[Dict[Any, Any], List[Dict[str, Any]]]:
+    """
+    Runs fn(pr) for every PR on a thread pool (settings.WORKFLOW_CONCURRENCY).
+    A failing PR is recorded and skipped instead of aborting the batch.
+    Returns ({pr_id: result}, [failure records]).
+    """
+    max_workers = max_workers or settings.WORKFLOW_CONCURRENCY
+    results, failures = {}, []
+
+    def run(pr):
+        try:
+            return pr["pr_id"], fn(pr), None
+        except Exception as e:
+            return pr["pr_id"], None, e
+
+    if max_workers <= 1:
+        outcomes = [run(pr) for pr in prs]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            outcomes = list(pool.map(run, prs))
+
+    for pr_id, result, error in outcomes:
+        if error is None:
+            results[pr_id] = result
+        else:
+            print(f"  ❌ PR {pr_id} failed in {stage}: {error}")
+            failures.append({"pr_id": pr_id, "stage": stage, "error": str(error)})
+
+    return results, failures
+
+
+# Chunks per context kind (file purpose / impact) in the prompt
+CONTEXT_K = 3
+
+
+def _active_prs(state: State) -> List[Dict[str, Any]]:
+    failed = {f["pr_id"] for f in state["failed"]}
+    return [pr for pr in state["prs"] if pr["pr_id"] not in failed]
 
 
 # -------------------------------------------------
 # 1️⃣ Fetch PR metadata (Correct)
 # -------------------------------------------------
-@action(reads=[], writes=["prs"])
+@action(reads=["force", "pr_filter"], writes=["prs"])
 def fetch_pr_metadata(state: State) -> State:
+    """
+    Selects only PRs whose fingerprint differs from the one their last
+    persisted report was built from (or that have no report yet).
+    state["force"] regenerates everything; state["pr_filter"] narrows by
+    repo / state / updated_since in SQL.
+
+    Rows are streamed from a server-side cursor in batches and only a
+    lightweight summary per PR goes into Burr state; patches are loaded
+    per PR when a step needs them (see load_pr_files).
+    """
     print("Fetching PR metadata from database...")
-    db = get_session()
-    prs = db.query(PRMetadata).all() 
-    db.close()
+    pr_filter = state["pr_filter"]
 
-    pr_dicts = []
-    for pr in prs:
-        # Calculate header stats
-        total_added = sum(f.get("additions", 0) for f in pr.files)
-        total_removed = sum(f.get("deletions", 0) for f in pr.files)
-
-        pr_dicts.append({
-            "pr_id": pr.id,
-            "pr_number": pr.pr_number,
-            "title": pr.title,
-            "author": pr.author,
-            "url": pr.url,
-            "stats": f"+{total_added} / -{total_removed}", 
-            "rich_files": pr.files # Contains patch, status, etc.
-        })
+    with session_scope() as db:
+        pr_dicts = _select_prs(db, pr_filter, state["force"])
 
+    print(f"  {len(pr_dicts)} PR(s) changed since their last report")
     return state.update(prs=pr_dicts)
 
 
+def _select_prs(db, pr_filter: Dict[str, Any], force: bool) -> List[Dict[str, Any]]:
+    # +/- totals and file names aggregated in SQL, not from file payloads
+    stats = (
+        db.query(
+            PRFile.pr_id,
+            func.sum(PRFile.additions).label("added"),
+            func.sum(PRFile.deletions).label("removed"),
+            func.array_agg(aggregate_order_by(PRFile.filename, PRFile.filename)).label("filenames"),
+        )
+        .group_by(PRFile.pr_id)
+        .subquery()
+    )
+    query = (
+        db.query(
+            PRMetadata.id,
+            PRMetadata.pr_number,
+            PRMetadata.repo,
+            PRMetadata.title,
+            PRMetadata.author,
+            PRMetadata.url,
+            PRMetadata.fingerprint,
+            stats.c.added,
+            stats.c.removed,
+            stats.c.filenames,
+        )
+        .outerjoin(stats, stats.c.pr_id == PRMetadata.id)
+    )
+    if pr_filter.get("repo"):
+        query = query.filter(PRMetadata.repo == pr_filter["repo"])
+    if pr_filter.get("state"):
+        query = query.filter(PRMetadata.state == pr_filter["state"])
+    if pr_filter.get("updated_since"):
+        query = query.filter(PRMetadata.updated_at >= pr_filter["updated_since"])
+    if not force:
+        query = (
+            query.outerjoin(PRReport, PRReport.pr_id == cast(PRMetadata.id, String))
+            .filter(or_(
+                PRReport.id.is_(None),
+                PRReport.fingerprint.is_distinct_from(PRMetadata.fingerprint),
+            ))
+        )
+
+    return [
+        {
+            "pr_id": row.id,
+            "pr_number": row.pr_number,
+            "repo": row.repo,
+            "title": row.title,
+            "author": row.author,
+            "url": row.url,
+            "fingerprint": row.fingerprint,
+            "stats": f"+{row.added or 0} / -{row.removed or 0}",
+            "filenames": list(row.filenames or []),
+        }
+        for row in query.order_by(PRMetadata.id).yield_per(settings.WORKFLOW_FETCH_BATCH_SIZE)
+    ]
+
+
+def get_pr_files(pr_id: int) -> List[Dict[str, Any]]:
+    """Patches etc. for one PR, fetched on demand instead of carried in state."""
+    with session_scope() as db:
+        return load_pr_files(db, pr_id)
+
+
 # -------------------------------------------------
 # 2️⃣ Collect related context (Optimized: Reads directly from 'prs')
 # -------------------------------------------------
-@action(reads=["prs"], writes=["context"])
+@action(reads=["prs", "failed"], writes=["context", "failed"])
 def collect_related_context(state: State) -> State:
     print("Collecting related context from vector store...")
-    vector_store = VectorStore()
-    context = []
-
-    for pr in state["prs"]:
-        # Extract filenames from the rich_files we fetched in Step 1
-        filenames = [f["filename"] for f in pr["rich_files"]]
-        
-        # Search 1: File Purpose
-        file_query = f"Explain the high-level purpose of these files: {filenames}"
-        file_nodes = vector_store.semantic_search(file_query, k=3)
-
-        # Search 2: Impact/Dependencies
-        impact_query = f"Find code that imports or calls functions from: {filenames}"
-        impact_nodes = vector_store.semantic_search(impact_query, k=3)
-
-        context.append({
+    prs = _active_prs(state)
+
+    def queries_for(pr):
+        # File names were aggregated in Step 1
+        filenames = pr["filenames"]
+        return [
+            # Search 1: File Purpose
+            f"Explain the high-level purpose of these files: {filenames}",
+            # Search 2: Impact/Dependencies
+            f"Find code that imports or calls functions from: {filenames}",
+        ]
+
+    def to_context(pr, file_nodes, impact_nodes, affected):
+        return {
             "pr_id": pr["pr_id"],
-            "file_context": [n.text for n in file_nodes],
-            "impact_context": [n.text for n in impact_nodes]
-        })
+            "file_context": [{"file_path": n.node.metadata.get("file_path"), "text": n.text} for n in file_nodes],
+            "impact_context": [{"file_path": n.node.metadata.get("file_path"), "text": n.text} for n in impact_nodes],
+            "affected_files": [{"file_path": path, "depth": depth} for path, depth in affected],
+        }
+
+    lexical = get_lexical_index() if settings.LEXICAL_INDEX_ENABLED else None
+
+    def repo_context(repo, repo_prs, vector_store):
+        """
+        Fuses vector hits with exact-match hits (reciprocal rank fusion).
+        Dependents of the changed files come from the import graph and
+        importers from the symbol index; the embedding query for impact
+        only runs when neither knows any.
+        """
+        with session_scope() as db:
+            reverse = load_reverse_graph(db, repo)
+        affected = {pr["pr_id"]: affected_files(reverse, pr["filenames"]) for pr in repo_prs}
+
+        def lexical_for(pr):
+            if not lexical:
+                return [], []
+            terms = [t for f in pr["filenames"] for t in path_terms(f)]
+            impact = lexical.find_importers(repo, pr["filenames"], k=CONTEXT_K)
+            if len(impact) < CONTEXT_K and affected[pr["pr_id"]]:
+                # Call sites anywhere in the dependents the import graph found
+                impact += lexical.search(
+                    repo, terms, k=CONTEXT_K,
+                    file_paths=[path for path, _ in affected[pr["pr_id"]]],
+                )
+            return lexical.search(repo, terms, k=CONTEXT_K), impact
+
+        lexical_hits = {pr["pr_id"]: lexical_for(pr) for pr in repo_prs}
+
+        purpose_q, impact_q = zip(*(queries_for(pr) for pr in repo_prs))
+        needs_impact = [
+            pr for pr in repo_prs
+            if not affected[pr["pr_id"]] and len(lexical_hits[pr["pr_id"]][1]) < CONTEXT_K
+        ]
+        impact_index = {pr["pr_id"]: i for i, pr in enumerate(needs_impact)}
+
+        # One embedding call + one Qdrant round trip for all PRs of the repo
+        queries = list(purpose_q) + [
+            impact_q[i] for i, pr in enumerate(repo_prs) if pr["pr_id"] in impact_index
+        ]
+        results = vector_store.semantic_search_many(queries, k=CONTEXT_K)
+
+        contexts = []
+        for i, pr in enumerate(repo_prs):
+            purpose_lex, impact_lex = lexical_hits[pr["pr_id"]]
+            impact_vec = []
+            if pr["pr_id"] in impact_index:
+                impact_vec = results[len(repo_prs) + impact_index[pr["pr_id"]]]
+            contexts.append(to_context(
+                pr,
+                reciprocal_rank_fusion([results[i], purpose_lex], k=CONTEXT_K),
+                reciprocal_rank_fusion([impact_lex, impact_vec], k=CONTEXT_K),
+                affected[pr["pr_id"]],
+            ))
+        return contexts
+
+    by_repo: Dict[str, List[Dict[str, Any]]] = {}
+    for pr in prs:
+        by_repo.setdefault(pr["repo"], []).append(pr)
+
+    context, failures = [], []
+    for repo, repo_prs in by_repo.items():
+        # Only this repo's chunks: another codebase's code is no context for its PRs
+        vector_store = get_vector_store_service(repo)
+        try:
+            context += repo_context(repo, repo_prs, vector_store)
+        except Exception as e:
+            # Retry PR by PR so a single bad PR cannot sink the whole batch
+            print(f"  ⚠️ Batched context search for {repo} failed ({e}), retrying per PR...")
+            by_pr, repo_failures = fan_out(
+                "collect_related_context",
+                lambda pr: repo_context(repo, [pr], vector_store)[0],
+                repo_prs,
+            )
+            context += list(by_pr.values())
+            failures += repo_failures
 
-    return state.update(context=context)
+    return state.update(context=context, failed=state["failed"] + failures)
 
 
 # -------------------------------------------------
 # 3️⃣ Summarize changes (Correct)
 # -------------------------------------------------
-@action(reads=["prs", "context"], writes=["summaries"])
+def summarize_pr(
+    pr: Dict[str, Any],
+    ctx: Dict[str, Any],
+    generate: Callable[[str], Dict[str, Any]] = generate_json,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    LLM summary of one PR from a prompt packed to PROMPT_TOKEN_BUDGET;
+    returns (summary, token usage). `generate` answers the prompts
+    (a BatchCollector in batch mode).
+    """
+    files = get_pr_files(pr["pr_id"])
+    prompt, usage = build_summary_prompt(pr, files, ctx)
+
+    groups, skipped = [], []
+    if (
+        settings.SUMMARY_MAP_REDUCE
+        and usage["hunks"] < usage["hunks_total"]
+        and usage["diff_tokens_total"] >= settings.SUMMARY_MAP_MIN_DIFF_TOKENS
+    ):
+        # The diff is far too large for one prompt: summarise it in parts instead of dropping hunks
+        groups, skipped = plan_map_groups(files)
+
+    # No groups when only lockfile-style churn overflowed; the packed prompt covers that
+    if groups:
+        summary, usage = summarize_large_pr(pr, files, ctx, groups, skipped, usage["hunks_total"], generate)
+    else:
+        # Ensure your client parses JSON string to dict
+        summary = generate(prompt)
+
+    print(f"  PR #{pr['pr_number']} prompt: {format_usage(usage)}")
+    return summary, usage
+
+
+def summarize_large_pr(
+    pr: Dict[str, Any],
+    files: List[Dict[str, Any]],
+    ctx: Dict[str, Any],
+    groups: List[List[Dict[str, Any]]],
+    skipped: List[str],
+    hunks_total: int,
+    generate: Callable[[str], Dict[str, Any]] = generate_json,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Map-reduce for PRs too large for one prompt, over the groups and skipped
+    files from plan_map_groups (at least one group). Map: groups of hunks are
+    summarised in parallel (SUMMARY_MAP_CONCURRENCY) by small calls that
+    go through the response cache, so a rerun only pays for changed parts.
+    Reduce: one call merges the partial impacts and snippets with the
+    retrieval context. File summaries come straight from the map calls.
+    """
+    skipped = list(skipped)
+    prompts = [build_map_prompt(pr, files, group, i + 1, len(groups)) for i, group in enumerate(groups)]
+
+    partials, failed_parts, pending = [], 0, False
+    with ThreadPoolExecutor(max_workers=max(1, min(settings.SUMMARY_MAP_CONCURRENCY, len(prompts)))) as pool:
+        futures = [pool.submit(generate, p) for p in prompts]
+        for group, future in zip(groups, futures):
+            try:
+                partials.append(future.result())
+            except BatchPending:
+                # Batch mode: every map prompt gets queued before giving up on this round
+                pending = True
+            except Exception as e:
+                failed_parts += 1
+                skipped += list(dict.fromkeys(files[h["file"]]["filename"] for h in group))
+                print(f"  ⚠️ PR #{pr['pr_number']}: map call failed ({e})")
+    if pending:
+        raise BatchPending(f"PR #{pr['pr_number']}: map prompts queued")
+    if not partials:
+        raise RuntimeError(f"all {len(prompts)} map calls failed")
+
+    by_file: Dict[str, List[str]] = {}
+    for partial in partials:
+        for s in partial.get("file_summaries") or []:
+            if isinstance(s, dict) and s.get("file") and s.get("summary"):
+                by_file.setdefault(s["file"], []).append(str(s["summary"]))
+    file_summaries = [
+        {"file": f["filename"], "summary": " ".join(by_file[f["filename"]])}
+        for f in files if f["filename"] in by_file
+    ]
+    skipped = [name for name in dict.fromkeys(skipped) if name not in by_file]
+    if skipped:
+        file_summaries.append({"file": f"{len(skipped)} more file(s)", "summary": "Not summarised: " + ", ".join(skipped)})
+
+    prompt, usage = build_reduce_prompt(pr, files, ctx, file_summaries, partials)
+    reduced = generate(prompt)
+
+    usage.update(
+        hunks=sum(len(group) for group in groups),
+        hunks_total=hunks_total,
+        map_calls=len(prompts),
+        map_failed=failed_parts,
+        map_tokens=sum(count_tokens(p) for p in prompts),
+    )
+    summary = {
+        "tldr": reduced.get("tldr", []),
+        "file_summaries": file_summaries,
+        "impact": reduced.get("impact", ""),
+        "key_snippet": reduced.get("key_snippet", ""),
+    }
+    return summary, usage
+
+
+@action(reads=["prs", "context", "failed"], writes=["summaries", "failed"])
 def summarize_changes(state: State) -> State:
     print("Summarizing PR changes using LLM...")
-    summaries = []
-
-    for pr in state["prs"]:
-        # Find matching context
-        ctx = next(c for c in state["context"] if c["pr_id"] == pr["pr_id"])
-        
-        diff_text = ""
-        # Safety check: ensure rich_files exists
-        files = pr.get("rich_files", [])
-        
-        for f in files[:3]: 
-            patch = f.get("patch", "")
-            if patch:
-                diff_text += f"\nFile: {f['filename']}\n{patch}\n"
-
-        prompt = f"""
-        You are generating a PR report.
-        
-        METADATA:
-        Title: {pr['title']}
-        Files Changed: {[f['filename'] for f in files]}
-        
-        CONTEXT:
-        File Purposes: {ctx['file_context']}
-        Impact Analysis: {ctx['impact_context']}
-        
-        CODE DIFFS:
-        {diff_text[:6000]} 
-
-        TASK:
-        Return valid JSON with keys: "tldr" (list), "file_summaries" (list), "impact" (string), "key_snippet" (string code block content).
-        """
+    context = {c["pr_id"]: c for c in state["context"]}
 
-        # Ensure your client parses JSON string to dict
-        summary_json = generate_json(prompt)
+    by_pr, failures = fan_out(
+        "summarize_changes",
+        lambda pr: summarize_pr(pr, context[pr["pr_id"]]),
+        _active_prs(state),
+    )
 
-        summaries.append({
-            "pr_id": pr["pr_id"],
-            "content": summary_json 
-        })
+    summaries = [
+        {"pr_id": pr_id, "content": summary_json, "prompt_usage": usage}
+        for pr_id, (summary_json, usage) in by_pr.items()
+    ]
+
+    if summaries:
+        total = sum(s["prompt_usage"]["tokens"] for s in summaries)
+        print(f"  Prompt tokens: {total:,} for {len(summaries)} PR(s)")
+
+    if settings.LLM_CACHE_ENABLED:
+        stats = response_cache_stats()
+        print(f"  LLM cache: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%})")
+
+    return state.update(summaries=summaries, failed=state["failed"] + failures)
 
-    return state.update(summaries=summaries)
+
+# -------------------------------------------------
+# 3️⃣b Summarize through the batch API (LLM_BATCH_MODE)
+# -------------------------------------------------
+@action(
+    reads=["prs", "context", "summaries", "failed", "batch_failed"],
+    writes=["summaries", "batch_jobs", "failed"],
+)
+def submit_batch(state: State) -> State:
+    """
+    Runs summarize_pr for every PR not summarised yet, answering prompts
+    from earlier batch jobs (via the response cache). Prompts still
+    unanswered go out as one batch job; poll_batch waits for it and hands
+    back here. Map-reduce PRs take two rounds (map, then reduce).
+    A job left open by an interrupted run is polled instead of resubmitted.
+    """
+    print("Summarizing PR changes via batch API...")
+    context = {c["pr_id"]: c for c in state["context"]}
+    done = {s["pr_id"] for s in state["summaries"]}
+    collector = BatchCollector(state["batch_failed"])
+    waiting = []
+
+    def run(pr):
+        try:
+            return summarize_pr(pr, context[pr["pr_id"]], generate=collector)
+        except BatchPending:
+            waiting.append(pr["pr_id"])
+            return None
+
+    by_pr, failures = fan_out("summarize_changes", run, [pr for pr in _active_prs(state) if pr["pr_id"] not in done])
+
+    summaries = list(state["summaries"])
+    for pr_id, result in by_pr.items():
+        if result is not None:
+            summary_json, usage = result
+            summaries.append({"pr_id": pr_id, "content": summary_json, "prompt_usage": usage})
+
+    jobs = open_jobs()
+    if jobs:
+        print(f"  📦 Resuming {len(jobs)} open batch job(s)")
+    elif waiting:
+        jobs = [submit_requests(list(collector.pending.values()))]
+        print(f"  📦 Submitted batch {jobs[0]}: {len(collector.pending)} prompt(s) for {len(waiting)} PR(s)")
+
+    return state.update(summaries=summaries, batch_jobs=jobs, failed=state["failed"] + failures)
+
+
+@action(reads=["batch_jobs", "batch_failed"], writes=["batch_jobs", "batch_failed"])
+def poll_batch(state: State) -> State:
+    print("Waiting for batch results...")
+    batch_failed = dict(state["batch_failed"])
+    for job_id in state["batch_jobs"]:
+        batch_failed.update(wait_and_collect(job_id))
+    return state.update(batch_jobs=[], batch_failed=batch_failed)
 
 
 # -------------------------------------------------
 # 4️⃣ Generate Markdown report (Corrected)
 # -------------------------------------------------
-@action(reads=["prs", "summaries"], writes=["reports"])
+@action(reads=["prs", "summaries", "failed"], writes=["reports", "failed"])
 def generate_markdown_report(state: State) -> State:
     print("Generating markdown reports...")
-    
+
     # Initialize the generator (This handles formatting & disk saving)
     generator = ReportGenerator(output_dir=settings.REPORTS_DIR)
-    
-    reports = []
-    
-    for pr in state["prs"]:
+    summaries = {s["pr_id"]: s["content"] for s in state["summaries"]}
+
+    def render(pr):
         # 1. Get the LLM data for this PR
-        summary_entry = next(s for s in state["summaries"] if s["pr_id"] == pr["pr_id"])
-        llm_data = summary_entry["content"]
-        
+        llm_data = summaries[pr["pr_id"]]
+
         # 2. Generate the Markdown String
         md_content = generator.format_markdown(pr, llm_data)
 
         # 3. Save to Disk (returns the file path)
-        file_path = generator.save_file(pr["pr_number"], md_content)
+        file_path = generator.save_file(pr["pr_number"], md_content, repo=pr["repo"])
 
         # 4. Add to state so the next step (Persist) can read it
-        reports.append({
-            "pr_id": pr["pr_id"], 
+        return {
+            "pr_id": pr["pr_id"],
             "markdown": md_content,
             "file_path": file_path
-        })
+        }
 
-    return state.update(reports=reports)
+    by_pr, failures = fan_out("generate_markdown_report", render, _active_prs(state))
+
+    return state.update(reports=list(by_pr.values()), failed=state["failed"] + failures)
 
 # -------------------------------------------------
 # 5️⃣ Persist report (Corrected)
 # -------------------------------------------------
-@action(reads=["reports"], writes=["persisted"])
+@action(reads=["prs", "reports", "failed"], writes=["persisted"])
 def persist_report(state: State) -> State:
     print("Persisting reports to database...")
-    db = get_session()
-    
-    for r in state["reports"]:
-        # Create or Update the DB Record
-        report_record = PRReport(
-            id=f"report-{r['pr_id']}",  # Unique ID
-            pr_id=r["pr_id"],
-            report_md=r["markdown"],    # Save the full markdown text
-            file_path=r["file_path"]    # Optional: Save where it is on disk
-        )
-        
-        # Merge handles both Insert and Update
-        db.merge(report_record)
+    fingerprints = {pr["pr_id"]: pr.get("fingerprint") for pr in state["prs"]}
+
+    with session_scope() as db:
+        for r in state["reports"]:
+            # Create or Update the DB Record
+            report_record = PRReport(
+                id=f"report-{r['pr_id']}",  # Unique ID
+                pr_id=str(r["pr_id"]),
+                report_md=r["markdown"],    # Save the full markdown text
+                file_path=r["file_path"],   # Optional: Save where it is on disk
+                fingerprint=fingerprints.get(r["pr_id"]),
+            )
+
+            # Merge handles both Insert and Update
+            db.merge(report_record)
 
-    db.commit()
-    db.close()
+    if state["failed"]:
+        print(f"⚠️ {len(state['failed'])} PR(s) failed and were skipped:")
+        for f in state["failed"]:
+            print(f"  - PR {f['pr_id']} ({f['stage']}): {f['error']}")
 
     return state.update(persisted=True)
 
 # -------------------------------------------------
 # Build Burr Application (Updated Transitions)
 # -------------------------------------------------
-def build_burr_app():
+def build_burr_app(
+    force: bool = False,
+    repo: str | None = None,
+    pr_state: str | None = None,
+    updated_since=None,
+    batch: bool | None = None,
+):
+    """batch=True (default: LLM_BATCH_MODE) summarises through the batch API instead of live calls."""
     return (
         ApplicationBuilder()
         .with_actions(
             fetch_pr_metadata,
             collect_related_context,
             summarize_changes,
+            submit_batch,
+            poll_batch,
             generate_markdown_report,
             persist_report,
         )
         .with_transitions(
             # Direct link from Fetch -> Context
             ("fetch_pr_metadata", "collect_related_context"),
-            ("collect_related_context", "summarize_changes"),
+            ("collect_related_context", "submit_batch", when(batch=True)),
+            ("collect_related_context", "summarize_changes", default),
+            ("submit_batch", "generate_markdown_report", when(batch_jobs=[])),
+            ("submit_batch", "poll_batch", default),
+            ("poll_batch", "submit_batch"),
             ("summarize_changes", "generate_markdown_report"),
             ("generate_markdown_report", "persist_report"),
         )
         .with_state(
+            force=force,
+            pr_filter={"repo": repo, "state": pr_state, "updated_since": updated_since},
             prs=[],
             # pr_files=[], <-- REMOVED
             context=[],
             summaries=[],
+            batch=settings.LLM_BATCH_MODE if batch is None else batch,
+            batch_jobs=[],
+            batch_failed={},
             reports=[],
+            failed=[],
             persisted=False,
         )
         .with_entrypoint("fetch_pr_metadata")
@@ -1,8 +1,13 @@
 from sqlalchemy import create_engine, Column, String, Text, Integer, DateTime, JSON
 from datetime import datetime
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session, relationship, deferred, undefer
+from sqlalchemy import text, UniqueConstraint, literal_column, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import Any, Dict, List
+from contextlib import contextmanager
 from config import settings
 import json
+import threading
 from sqlalchemy import Column, Integer, String, DateTime
 from sqlalchemy.dialects.postgresql import JSONB  # ✅ Use JSONB for Postgres
 
@@ -10,6 +15,9 @@ Base = declarative_base()
 
 class PRMetadata(Base):
     __tablename__ = "pull_requests-test"
+    __table_args__ = (
+        UniqueConstraint("repo", "pr_number", name="uq_pull_requests_repo_pr_number"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     pr_number = Column(Integer, index=True)
@@ -18,11 +26,51 @@ class PRMetadata(Base):
     author = Column(String)
     url = Column(String)
     created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    state = Column(String, index=True)  # "open" / "closed"
+    head_sha = Column(String)
+    # sha256 of head SHA + every file's patch; changes whenever the PR moves
+    fingerprint = Column(String)
     
-    # ✅ CHANGED: This stores the rich [{"filename": "...", "patch": "..."}] structure
-    files = Column(JSONB)
-    
+    # Legacy [{"filename": "...", "patch": "..."}] blob. init_db() moves it into
+    # pr_files; never loaded unless asked for.
+    files = deferred(Column(JSONB))
+
+    pr_files = relationship(
+        "PRFile",
+        back_populates="pr",
+        order_by="PRFile.filename",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+
+class FileContent(Base):
+    """Full file contents, stored once per git blob SHA and shared across PRs."""
+    __tablename__ = "file_contents"
+
+    blob_sha = Column(String, primary_key=True)
+    content = deferred(Column(Text))
+
 
+class PRFile(Base):
+    """One changed file of a PR. Stats are plain columns; patch / content load lazily."""
+    __tablename__ = "pr_files"
+    __table_args__ = (
+        UniqueConstraint("pr_id", "filename", name="uq_pr_files_pr_id_filename"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    pr_id = Column(Integer, ForeignKey(PRMetadata.id, ondelete="CASCADE"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    status = Column(String)
+    additions = Column(Integer, nullable=False, default=0)
+    deletions = Column(Integer, nullable=False, default=0)
+    blob_sha = Column(String, ForeignKey(FileContent.blob_sha), index=True)
+    patch = deferred(Column(Text))
+
+    pr = relationship(PRMetadata, back_populates="pr_files")
+    content = relationship(FileContent, lazy="select")
 
 
 class PRReport(Base):
@@ -32,13 +80,251 @@ class PRReport(Base):
     pr_id = Column(String)
     report_md = Column(Text)
     file_path = Column(String)
+    # PRMetadata.fingerprint this report was generated from
+    fingerprint = Column(String)
+
+
+class IngestionManifest(Base):
+    """One row per ingested file: the blob SHA it was built from and the Qdrant points it produced."""
+    __tablename__ = "ingestion_manifest"
+
+    repo = Column(String, primary_key=True)
+    file_path = Column(String, primary_key=True)
+    blob_sha = Column(String, nullable=False)
+    point_ids = Column(JSONB, nullable=False, default=list)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class FileDependency(Base):
+    """
+    One import edge: `file_path` imports a module whose path ends in `target_key`
+    (see ingestion.imports). Looked up in reverse to find a file's dependents.
+    """
+    __tablename__ = "file_dependencies"
+    __table_args__ = (
+        Index("ix_file_dependencies_repo_target", "repo", "target_key"),
+    )
+
+    repo = Column(String, primary_key=True)
+    file_path = Column(String, primary_key=True)
+    target_key = Column(String, primary_key=True)
+
+class IngestedRepo(Base):
+    """Per-repo ingestion state: when the import graph last covered every file (a repo may have no edges)."""
+    __tablename__ = "ingested_repos"
+
+    repo = Column(String, primary_key=True)
+    graph_built_at = Column(DateTime)
+
+class GitHubETag(Base):
+    """Validators of the last successful GitHub list request, for conditional re-fetches."""
+    __tablename__ = "github_etags"
+
+    request_key = Column(String, primary_key=True)
+    etag = Column(String)
+    last_modified = Column(String)
+
+
+# ========================
+# ENGINE / SESSIONS
+# ========================
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    The one engine of the process, created on first use (importing this module
+    does not touch the database). Pool sized for the workflow's worker threads.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(
+                settings.DB_URL,
+                pool_size=settings.DB_POOL_SIZE,
+                max_overflow=settings.DB_MAX_OVERFLOW,
+                pool_pre_ping=settings.DB_POOL_PRE_PING,
+                pool_recycle=settings.DB_POOL_RECYCLE,
+            )
+            SessionLocal.configure(bind=_engine)
+        return _engine
+
+
+SessionLocal = sessionmaker()
+# Thread-local session registry: each worker thread gets its own Session
+ScopedSession = scoped_session(SessionLocal)
+
+# Idempotent schema changes for databases created by an older init_db().
+# create_all() only creates missing tables, never missing columns.
+MIGRATIONS = [
+    'ALTER TABLE "pull_requests-test" ADD COLUMN IF NOT EXISTS head_sha VARCHAR',
+    'ALTER TABLE "pull_requests-test" ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP',
+    'ALTER TABLE "pull_requests-test" ADD COLUMN IF NOT EXISTS state VARCHAR',
+    'ALTER TABLE "pull_requests-test" ADD COLUMN IF NOT EXISTS fingerprint VARCHAR',
+    'ALTER TABLE "pr_reports-test" ADD COLUMN IF NOT EXISTS fingerprint VARCHAR',
+    # (repo, pr_number) must be unique for ON CONFLICT upserts: drop older duplicates first
+    'DELETE FROM "pull_requests-test" a USING "pull_requests-test" b'
+    ' WHERE a.repo = b.repo AND a.pr_number = b.pr_number AND a.id < b.id',
+    'CREATE UNIQUE INDEX IF NOT EXISTS uq_pull_requests_repo_pr_number'
+    ' ON "pull_requests-test" (repo, pr_number)',
+    # Move legacy PRMetadata.files JSONB into pr_files, then free the blob
+    'INSERT INTO pr_files (pr_id, filename, status, additions, deletions, patch)'
+    " SELECT p.id, f->>'filename', f->>'status',"
+    " COALESCE((f->>'additions')::int, 0), COALESCE((f->>'deletions')::int, 0), f->>'patch'"
+    ' FROM "pull_requests-test" p, jsonb_array_elements(p.files) f'
+    " WHERE jsonb_typeof(p.files) = 'array'"
+    ' ON CONFLICT (pr_id, filename) DO NOTHING',
+    'UPDATE "pull_requests-test" SET files = NULL WHERE files IS NOT NULL',
+]
 
-engine = create_engine(settings.DB_URL)
-SessionLocal = sessionmaker(bind=engine)
 
 def init_db():
+    engine = get_engine()
     Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for statement in MIGRATIONS:
+            conn.execute(text(statement))
 
 def get_session():
+    get_engine()
     return SessionLocal()
+
+
+@contextmanager
+def session_scope():
+    """
+    Thread-local session for one unit of work: commits on success, rolls back
+    on error and always returns the connection to the pool. Safe to use from
+    worker threads; nested use in the same thread shares the session.
+    """
+    get_engine()
+    if ScopedSession.registry.has():
+        yield ScopedSession()
+        return
+
+    session = ScopedSession()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        ScopedSession.remove()
+
+
+def upsert_pr_metadata(db, rows: List[Dict[str, Any]], batch_size: int | None = None) -> List[Any]:
+    """
+    INSERT ... ON CONFLICT (repo, pr_number) DO UPDATE, a batch per statement.
+    Rows may carry only the columns that changed; rows are grouped by column set.
+    Does not commit, so the caller controls the transaction.
+    Returns one (pr_number, id, inserted) row per upserted PR.
+    """
+    batch_size = batch_size or settings.DB_UPSERT_BATCH_SIZE
+    table = PRMetadata.__table__
+
+    # Postgres rejects a statement that touches the same row twice; last row wins
+    rows = list({(row["repo"], row["pr_number"]): row for row in rows}.values())
+
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    results = []
+    for columns, group in groups.items():
+        for i in range(0, len(group), batch_size):
+            stmt = pg_insert(table).values(group[i:i + batch_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["repo", "pr_number"],
+                set_={c: stmt.excluded[c] for c in columns if c not in ("repo", "pr_number")},
+            ).returning(table.c.pr_number, table.c.id, literal_column("(xmax = 0)").label("inserted"))
+
+            results += db.execute(stmt).all()
+
+    return results
+
+
+def load_pr_files(db, pr_id: int) -> List[Dict[str, Any]]:
+    """Changed files of one PR including patches (contents stay in file_contents)."""
+    files = (
+        db.query(PRFile)
+        .options(undefer(PRFile.patch))
+        .filter(PRFile.pr_id == pr_id)
+        .order_by(PRFile.filename)
+    )
+    return [
+        {
+            "filename": f.filename,
+            "status": f.status,
+            "additions": f.additions,
+            "deletions": f.deletions,
+            "patch": f.patch,
+        }
+        for f in files
+    ]
+
+
+def existing_blob_shas(db, shas) -> set:
+    shas = list(set(shas))
+    found = set()
+    for i in range(0, len(shas), settings.DB_UPSERT_BATCH_SIZE):
+        chunk = shas[i:i + settings.DB_UPSERT_BATCH_SIZE]
+        found.update(
+            sha for (sha,) in db.query(FileContent.blob_sha).filter(FileContent.blob_sha.in_(chunk))
+        )
+    return found
+
+
+def replace_pr_files(
+    db,
+    files_by_pr_id: Dict[int, List[Dict[str, Any]]],
+    contents: Dict[str, str],
+    batch_size: int | None = None,
+):
+    """
+    Replaces the pr_files rows of the given PRs and stores new blob contents
+    (deduplicated by blob SHA). Does not commit.
+    """
+    batch_size = batch_size or settings.DB_UPSERT_BATCH_SIZE
+
+    content_rows = [{"blob_sha": sha, "content": c} for sha, c in contents.items()]
+    for i in range(0, len(content_rows), batch_size):
+        stmt = pg_insert(FileContent.__table__).values(content_rows[i:i + batch_size])
+        db.execute(stmt.on_conflict_do_nothing(index_elements=["blob_sha"]))
+
+    if not files_by_pr_id:
+        return
+
+    db.query(PRFile).filter(PRFile.pr_id.in_(list(files_by_pr_id))).delete(synchronize_session=False)
+
+    file_rows = [
+        {
+            "pr_id": pr_id,
+            "filename": f["filename"],
+            "status": f["status"],
+            "additions": f["additions"],
+            "deletions": f["deletions"],
+            "blob_sha": f.get("blob_sha"),
+            "patch": f.get("patch"),
+        }
+        for pr_id, files in files_by_pr_id.items()
+        for f in files
+    ]
+    for i in range(0, len(file_rows), batch_size):
+        db.execute(pg_insert(PRFile.__table__).values(file_rows[i:i + batch_size]))
+
+
+def upsert_etags(db, etags: Dict[str, tuple], batch_size: int | None = None):
+    """Writes {request_key: (etag, last_modified)}, a batch per statement. Does not commit."""
+    batch_size = batch_size or settings.DB_UPSERT_BATCH_SIZE
+    rows = [
+        {"request_key": key, "etag": etag, "last_modified": last_modified}
+        for key, (etag, last_modified) in etags.items()
+    ]
+    for i in range(0, len(rows), batch_size):
+        stmt = pg_insert(GitHubETag.__table__).values(rows[i:i + batch_size])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["request_key"],
+            set_={"etag": stmt.excluded.etag, "last_modified": stmt.excluded.last_modified},
+        ))
     
@@ -1,26 +1,5 @@
-from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import create_engine, Column, String, Text, Integer, DateTime, JSON
-from sqlalchemy.orm import declarative_base, sessionmaker
-from config import settings
-Base = declarative_base()
-
-
-
-class PRReport(Base):
-    __tablename__ = "pr_reports"
-
-    id = Column(String, primary_key=True)
-    pr_id = Column(String)
-    report_md = Column(Text)
-    file_path = Column(String)
-
-engine = create_engine(settings.DB_URL)
-SessionLocal = sessionmaker(bind=engine)
-
-def init_db():
-    Base.metadata.create_all(engine)
-
-def get_session():
-    return SessionLocal()
-
-init_db()
\ No newline at end of file
+"""
+Deprecated: kept so old imports keep working.
+Everything lives in database.py (one engine, one set of models).
+"""
+from database import Base, PRReport, get_engine, get_session, session_scope, init_db
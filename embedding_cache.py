@@ -0,0 +1,160 @@
+import hashlib
+import threading
+from array import array
+from typing import Any, Dict, List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import PrivateAttr
+
+from cache import DiskCache
+from config import settings
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Drop-in wrapper around any llama-index embedding model.
+    Looks every text up in a DiskCache keyed by (model, sha256(text)) and only
+    sends the misses to the wrapped model. Query embeddings may differ from
+    text embeddings of the same string (e.g. the local model's query prefix),
+    so they are keyed separately.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: DiskCache = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: DiskCache, **kwargs: Any):
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs,
+        )
+        self._inner = inner
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> DiskCache:
+        return self._cache
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    def _key(self, text: str, mode: str = "text") -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        # Text keys keep their original form so existing cache entries stay valid
+        if mode == "query":
+            return f"{self.model_name}:query:{digest}"
+        return f"{self.model_name}:{digest}"
+
+    @staticmethod
+    def _pack(embedding: List[float]) -> bytes:
+        return array("f", embedding).tobytes()
+
+    @staticmethod
+    def _unpack(data: bytes) -> List[float]:
+        return array("f", data).tolist()
+
+    def _lookup(self, texts: List[str], mode: str = "text") -> Dict[str, List[float]]:
+        found = self._cache.get_many(self._key(t, mode) for t in texts)
+        return {key: self._unpack(value) for key, value in found.items()}
+
+    def _store(self, texts: List[str], embeddings: List[List[float]], mode: str = "text"):
+        self._cache.set_many({
+            self._key(t, mode): self._pack(e) for t, e in zip(texts, embeddings)
+        })
+
+    def _merge(self, texts: List[str], cached: Dict[str, List[float]], missing: List[str], computed, mode: str = "text"):
+        fresh = dict(zip(missing, computed))
+        return [
+            cached[self._key(t, mode)] if self._key(t, mode) in cached else fresh[t]
+            for t in texts
+        ]
+
+    def _missing(self, texts: List[str], cached: Dict[str, List[float]], mode: str = "text") -> List[str]:
+        return list(dict.fromkeys(t for t in texts if self._key(t, mode) not in cached))
+
+    # -- sync ---------------------------------------------------------------
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        cached = self._lookup(texts)
+        missing = self._missing(texts, cached)
+        computed = self._inner._get_text_embeddings(missing) if missing else []
+        self._store(missing, computed)
+        return self._merge(texts, cached, missing, computed)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        cached = self._lookup([query], "query")
+        if cached:
+            return cached[self._key(query, "query")]
+        embedding = self._inner._get_query_embedding(query)
+        self._store([query], [embedding], "query")
+        return embedding
+
+    def get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """Query embeddings for several queries; misses go to the wrapped model in one batch where it can."""
+        cached = self._lookup(queries, "query")
+        missing = self._missing(queries, cached, "query")
+        computed = get_query_embeddings(self._inner, missing) if missing else []
+        self._store(missing, computed, "query")
+        return self._merge(queries, cached, missing, computed, "query")
+
+    # -- async --------------------------------------------------------------
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        cached = self._lookup(texts)
+        missing = self._missing(texts, cached)
+        computed = await self._inner._aget_text_embeddings(missing) if missing else []
+        self._store(missing, computed)
+        return self._merge(texts, cached, missing, computed)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        cached = self._lookup([query], "query")
+        if cached:
+            return cached[self._key(query, "query")]
+        embedding = await self._inner._aget_query_embedding(query)
+        self._store([query], [embedding], "query")
+        return embedding
+
+
+def _symmetric(model: BaseEmbedding) -> bool:
+    """Queries and texts use the same engine (OpenAI), so a query embeds like any text."""
+    engine = getattr(model, "_query_engine", None)
+    return engine is not None and engine == getattr(model, "_text_engine", None)
+
+
+def get_query_embeddings(model: BaseEmbedding, queries: List[str]) -> List[List[float]]:
+    """
+    Query-side embeddings of `queries`, batched where possible: the model's own
+    get_query_embeddings (LocalEmbedding, CachedEmbedding), a text batch for
+    symmetric models, and one call per query otherwise.
+    """
+    if hasattr(model, "get_query_embeddings"):
+        return model.get_query_embeddings(queries)
+    if _symmetric(model):
+        return model.get_text_embedding_batch(queries)
+    return [model.get_query_embedding(q) for q in queries]
+
+
+_cache: Optional[DiskCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> DiskCache:
+    """Process-wide cache instance so every VectorStore shares one connection and one set of counters."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskCache(
+                settings.EMBEDDING_CACHE_PATH,
+                max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+                table="embeddings",
+            )
+        return _cache
@@ -0,0 +1,119 @@
+import threading
+from typing import Any, List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.embeddings.openai import OpenAIEmbedding
+from pydantic import PrivateAttr
+
+from config import settings
+from embedding_cache import CachedEmbedding, get_embedding_cache
+
+
+class LocalEmbedding(BaseEmbedding):
+    """
+    Runs a sentence-transformers model in-process (CPU by default, torch or
+    ONNX runtime), so ingestion and queries need no network round trip.
+    LOCAL_EMBEDDING_MODEL may be a hub name or a local directory; with
+    HF_HUB_OFFLINE=1 nothing is downloaded.
+
+    Texts are encoded in batches of LOCAL_EMBEDDING_BATCH_SIZE; the runtime
+    spreads each batch over LOCAL_EMBEDDING_THREADS cores. The model is
+    loaded on first use and shared by all threads.
+    """
+
+    _model: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, model_name: Optional[str] = None, **kwargs: Any):
+        super().__init__(
+            model_name=model_name or settings.LOCAL_EMBEDDING_MODEL,
+            embed_batch_size=settings.LOCAL_EMBEDDING_BATCH_SIZE,
+            **kwargs,
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalEmbedding"
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError as e:
+                    raise ImportError(
+                        "EMBEDDING_BACKEND=local needs sentence-transformers "
+                        "(pip install sentence-transformers)"
+                    ) from e
+
+                if settings.LOCAL_EMBEDDING_THREADS:
+                    import torch
+                    torch.set_num_threads(settings.LOCAL_EMBEDDING_THREADS)
+
+                self._model = SentenceTransformer(
+                    self.model_name,
+                    device=settings.LOCAL_EMBEDDING_DEVICE,
+                    backend=settings.LOCAL_EMBEDDING_RUNTIME,
+                )
+            return self._model
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors = self.model.encode(
+            texts,
+            batch_size=settings.LOCAL_EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.tolist()
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        # Retrieval models such as bge / e5 expect an instruction before queries
+        return self._encode([settings.LOCAL_EMBEDDING_QUERY_PREFIX + query])[0]
+
+    def get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        return self._encode([settings.LOCAL_EMBEDDING_QUERY_PREFIX + q for q in queries])
+
+    # Inference is CPU-bound and releases the GIL; no separate async path
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._get_text_embeddings(texts)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+
+def get_embed_model() -> BaseEmbedding:
+    """
+    Embedding model selected by EMBEDDING_BACKEND ("openai" or "local"),
+    behind the embedding cache when it is enabled.
+    """
+    backend = settings.EMBEDDING_BACKEND.lower()
+    if backend == "openai":
+        model = OpenAIEmbedding(
+            api_key=settings.OPENAI_API_KEY,
+            model=settings.EMBEDDING_MODEL,
+        )
+    elif backend == "local":
+        model = LocalEmbedding()
+    else:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND: {settings.EMBEDDING_BACKEND}")
+
+    if settings.EMBEDDING_CACHE_ENABLED:
+        model = CachedEmbedding(model, get_embedding_cache())
+    return model
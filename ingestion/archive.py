@@ -0,0 +1,95 @@
+import os
+import subprocess
+import tarfile
+from typing import Iterator, Optional
+
+from llama_index.core import Document
+
+from config import settings
+from ingestion.document import detect_language, make_document
+from ingestion.github_api import github_get
+from ingestion.manifest import git_blob_sha
+
+
+def iter_archive_documents(
+    owner: str,
+    repo: str,
+    branch: str,
+    token: Optional[str],
+    commit: Optional[str] = None,
+) -> Iterator[Document]:
+    """
+    Downloads the branch (or `commit`, if given) as a single tarball and
+    streams its members straight into Documents. Nothing is written to disk.
+    """
+    url = f"{settings.GITHUB_API}/repos/{owner}/{repo}/tarball/{commit or branch}"
+    r = github_get(url, token, stream=True)
+    r.raise_for_status()
+    r.raw.decode_content = True
+
+    with r, tarfile.open(fileobj=r.raw, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+
+            # Members are prefixed with "<owner>-<repo>-<sha>/"
+            parts = member.name.split("/", 1)
+            if len(parts) < 2:
+                continue
+            path = parts[1]
+
+            if not detect_language(path):
+                continue
+
+            f = tar.extractfile(member)
+            if f is None:
+                continue
+            data = f.read()
+            yield make_document(
+                f"{owner}/{repo}",
+                path,
+                data.decode("utf-8", errors="ignore"),
+                blob_sha=git_blob_sha(data),
+                commit=commit,
+            )
+
+
+def local_head_commit(root: str) -> Optional[str]:
+    """HEAD of a local git checkout, or None for a plain directory."""
+    try:
+        out = subprocess.run(
+            ["git", "-C", root, "rev-parse", "HEAD"],
+            capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def iter_local_documents(root: str, repo_name: str) -> Iterator[Document]:
+    """
+    Walks a local clone / checkout and yields Documents for supported files.
+    Hidden directories (.git, .venv, ...) are skipped.
+    """
+    root = os.path.abspath(root)
+    commit = local_head_commit(root)
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+
+        for name in sorted(filenames):
+            full_path = os.path.join(dirpath, name)
+            path = os.path.relpath(full_path, root).replace(os.sep, "/")
+
+            if not detect_language(path):
+                continue
+
+            with open(full_path, "rb") as f:
+                data = f.read()
+            yield make_document(
+                repo_name,
+                path,
+                data.decode("utf-8", errors="ignore"),
+                blob_sha=git_blob_sha(data),
+                commit=commit,
+            )
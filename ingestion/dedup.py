@@ -0,0 +1,174 @@
+import hashlib
+import re
+from collections import defaultdict
+from fnmatch import fnmatch
+from typing import Dict, List, Optional, Tuple
+
+from llama_index.core import Document
+from llama_index.core.schema import BaseNode
+
+from config import settings
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+# ========================
+# PATH / SIZE EXCLUSIONS
+# ========================
+def exclusion_reason(path: str, size: Optional[int] = None) -> Optional[str]:
+    """
+    Why a file should not be ingested at all, or None to keep it.
+    Patterns ending in "/" match a directory anywhere in the path
+    ("vendor/"); the others are globs matched against the full path and
+    the file name ("*_pb2.py").
+    """
+    parts = path.split("/")
+    for pattern in settings.INGEST_EXCLUDE_PATTERNS:
+        if pattern.endswith("/"):
+            if pattern.rstrip("/") in parts[:-1]:
+                return f"excluded dir {pattern}"
+        elif fnmatch(path, pattern) or fnmatch(parts[-1], pattern):
+            return f"matches {pattern}"
+
+    if size is not None and size > settings.INGEST_MAX_FILE_KB * 1024:
+        return f"larger than {settings.INGEST_MAX_FILE_KB} KB"
+    return None
+
+
+def document_exclusion_reason(doc: Document) -> Optional[str]:
+    """exclusion_reason() plus checks that need the content (minified / generated code)."""
+    text = doc.text
+    reason = exclusion_reason(doc.metadata["file_path"], len(text.encode("utf-8")))
+    if reason:
+        return reason
+
+    lines = text.count("\n") + 1
+    if len(text) / lines > settings.INGEST_MAX_AVG_LINE_LENGTH:
+        return "looks minified"
+    return None
+
+
+# ========================
+# CHUNK DEDUPLICATION
+# ========================
+def simhash(text: str, shingle: int = 3) -> int:
+    """64-bit SimHash over token shingles; similar texts differ in few bits."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    grams = [" ".join(tokens[i:i + shingle]) for i in range(max(1, len(tokens) - shingle + 1))]
+
+    votes = [0] * 64
+    for gram in grams:
+        h = int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            votes[bit] += 1 if h >> bit & 1 else -1
+
+    return sum(1 << bit for bit in range(64) if votes[bit] > 0)
+
+
+class ChunkDeduplicator:
+    """
+    Drops chunks before they are embedded:
+      - whole files whose content (blob SHA) was already seen in this run,
+      - chunks with identical text (whitespace-normalized),
+      - near-duplicate chunks: SimHash within INGEST_NEAR_DUP_DISTANCE bits.
+
+    Near-duplicate lookup uses banding: the 64 bits are cut into
+    distance + 1 bands, and two hashes within that distance must agree on at
+    least one band, so only hashes sharing a band are compared.
+
+    A dropped chunk is still content of its file: references() maps each
+    file to the kept points that stand in for its dropped chunks, so the
+    manifest can record them and keep them alive while any file uses them.
+    Not thread-safe; the pipeline calls it from the single split thread.
+    """
+
+    def __init__(self, max_distance: Optional[int] = None, min_tokens: int = 20):
+        self.max_distance = settings.INGEST_NEAR_DUP_DISTANCE if max_distance is None else max_distance
+        self.min_tokens = min_tokens
+        self.bands = self.max_distance + 1
+        self.band_bits = 64 // self.bands
+
+        self._blobs: Dict[str, str] = {}  # blob key -> first file with that content
+        self._exact: Dict[bytes, str] = {}  # text digest -> kept node id
+        self._buckets: List[Dict[int, List[Tuple[int, str]]]] = [defaultdict(list) for _ in range(self.bands)]
+        self._shared: Dict[str, List[str]] = defaultdict(list)  # file -> kept node ids of its dropped chunks
+        self._aliases: Dict[str, str] = {}  # duplicate file -> file it duplicates
+        self.stats = {"files": 0, "duplicate_files": 0, "chunks": 0, "exact": 0, "near": 0}
+
+    def is_duplicate_file(self, doc: Document) -> bool:
+        key = doc.metadata.get("blob_sha") or hashlib.sha1(doc.text.encode("utf-8")).hexdigest()
+        path = doc.metadata.get("file_path")
+        self.stats["files"] += 1
+        if key in self._blobs:
+            self.stats["duplicate_files"] += 1
+            if path and path != self._blobs[key]:
+                self._aliases[path] = self._blobs[key]
+            return True
+        self._blobs[key] = path
+        return False
+
+    def _band_keys(self, h: int):
+        mask = (1 << self.band_bits) - 1
+        return [(h >> (i * self.band_bits)) & mask for i in range(self.bands)]
+
+    def _near_duplicate_of(self, text: str, node_id: str) -> Optional[str]:
+        """Id of a kept chunk within max_distance of `text`; otherwise remembers this one."""
+        if self.max_distance <= 0 or len(_TOKEN_RE.findall(text)) < self.min_tokens:
+            return None
+
+        h = simhash(text)
+        keys = self._band_keys(h)
+        for band, key in enumerate(keys):
+            for other, other_id in self._buckets[band].get(key, ()):
+                if bin(h ^ other).count("1") <= self.max_distance:
+                    return other_id
+
+        for band, key in enumerate(keys):
+            self._buckets[band][key].append((h, node_id))
+        return None
+
+    def filter(self, nodes: List[BaseNode]) -> List[BaseNode]:
+        kept = []
+        for node in nodes:
+            self.stats["chunks"] += 1
+            text = node.get_content()
+
+            path = node.metadata.get("file_path")
+
+            digest = hashlib.sha256(" ".join(text.split()).encode("utf-8")).digest()
+            if digest in self._exact:
+                self.stats["exact"] += 1
+                self._shared[path].append(self._exact[digest])
+                continue
+            original = self._near_duplicate_of(text, node.node_id)
+            # Later exact copies must point at a chunk that actually gets written
+            self._exact[digest] = original or node.node_id
+            if original:
+                self.stats["near"] += 1
+                self._shared[path].append(original)
+                continue
+
+            kept.append(node)
+        return kept
+
+    def references(self, point_ids: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """
+        {file: ids of kept points standing in for its dropped content}, given
+        the points the pipeline wrote per file. A duplicate file refers to
+        everything its original wrote or refers to.
+        """
+        refs = {path: list(dict.fromkeys(ids)) for path, ids in self._shared.items()}
+        for path, original in self._aliases.items():
+            ids = point_ids.get(original, []) + refs.get(original, [])
+            refs[path] = list(dict.fromkeys(refs.get(path, []) + ids))
+        return refs
+
+    def report(self):
+        s = self.stats
+        dropped = s["exact"] + s["near"]
+        share = dropped / s["chunks"] if s["chunks"] else 0.0
+        print(
+            f"   dedup   {s['duplicate_files']} duplicate file(s) skipped; "
+            f"{dropped} of {s['chunks']} chunks not embedded ({share:.0%}: "
+            f"{s['exact']} exact, {s['near']} near-duplicate)"
+        )
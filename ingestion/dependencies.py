@@ -0,0 +1,106 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from llama_index.core import Document
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from config import settings
+from database import FileDependency, IngestedRepo
+from ingestion.imports import import_keys, import_suffixes, target_keys
+
+
+def document_imports(doc: Document) -> List[str]:
+    return import_keys(doc.text, doc.metadata.get("language") or "", doc.metadata["file_path"])
+
+
+def update_dependencies(
+    db,
+    repo: str,
+    imports: Dict[str, List[str]],
+    removed: Set[str],
+    batch_size: Optional[int] = None,
+):
+    """
+    imports: {file_path: import keys} for every file that was (re)ingested,
+             i.e. whose blob SHA changed; all other files keep their edges.
+    removed: file paths that no longer exist in the repo.
+    Does not commit.
+    """
+    batch_size = batch_size or settings.DB_UPSERT_BATCH_SIZE
+
+    paths = list(set(imports) | set(removed))
+    for i in range(0, len(paths), batch_size):
+        (
+            db.query(FileDependency)
+            .filter(FileDependency.repo == repo)
+            .filter(FileDependency.file_path.in_(paths[i:i + batch_size]))
+            .delete(synchronize_session=False)
+        )
+
+    rows = [
+        {"repo": repo, "file_path": path, "target_key": target}
+        for path, keys in imports.items()
+        for target in dict.fromkeys(s for key in keys for s in import_suffixes(key))
+    ]
+    for i in range(0, len(rows), batch_size):
+        stmt = pg_insert(FileDependency.__table__).values(rows[i:i + batch_size])
+        db.execute(stmt.on_conflict_do_nothing())
+
+
+def graph_built(db, repo: str) -> bool:
+    state = db.get(IngestedRepo, repo)
+    return state is not None and state.graph_built_at is not None
+
+
+def mark_graph_built(db, repo: str):
+    """Records that the repo's edges were derived from every file. Does not commit."""
+    db.merge(IngestedRepo(repo=repo, graph_built_at=datetime.utcnow()))
+
+
+def load_reverse_graph(db, repo: str) -> Dict[str, Set[str]]:
+    """{target_key: {files importing it}} for the whole repo, in one query."""
+    reverse: Dict[str, Set[str]] = defaultdict(set)
+    rows = (
+        db.query(FileDependency.target_key, FileDependency.file_path)
+        .filter(FileDependency.repo == repo)
+        .yield_per(10_000)
+    )
+    for target, path in rows:
+        reverse[target].add(path)
+    return reverse
+
+
+def affected_files(
+    reverse: Dict[str, Set[str]],
+    changed: List[str],
+    max_depth: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> List[Tuple[str, int]]:
+    """
+    Breadth-first walk over dependents: files importing a changed file are
+    depth 1, files importing those depth 2, ... up to max_depth.
+    Returns [(file_path, depth)] nearest first, at most `limit` entries.
+    """
+    max_depth = max_depth or settings.IMPACT_MAX_DEPTH
+    limit = limit or settings.IMPACT_MAX_FILES
+
+    seen = set(changed)
+    frontier = list(changed)
+    affected = []
+    for depth in range(1, max_depth + 1):
+        next_frontier = []
+        for path in frontier:
+            for key in target_keys(path):
+                for dependent in sorted(reverse.get(key, ())):
+                    if dependent in seen:
+                        continue
+                    seen.add(dependent)
+                    next_frontier.append(dependent)
+                    affected.append((dependent, depth))
+                    if len(affected) >= limit:
+                        return affected
+        if not next_frontier:
+            break
+        frontier = next_frontier
+    return affected
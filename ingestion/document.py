@@ -1,6 +1,9 @@
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from typing import List, Dict, Any, Optional, Iterator
 from llama_index.core import Document
-from ingestion.github_api import fetch_file
+from ingestion.github_api import fetch_file, get_http_session
+from config import settings
 
 SUPPORTED_EXTS = {
     ".py": "python",
@@ -10,27 +13,90 @@ SUPPORTED_EXTS = {
     ".go": "go",
 }
 
-def build_documents(owner: str, repo: str, tree: List[Dict[str, Any]], token: Optional[str]):
-    documents = []
-
-    for item in tree:
-        if item["type"] != "blob":
-            continue
-
-        for ext, lang in SUPPORTED_EXTS.items():
-            if item["path"].endswith(ext):
-                code = fetch_file(owner, repo, item["path"], token)
-
-                documents.append(
-                    Document(
-                        text=code,
-                        metadata={
-                            "repo": f"{owner}/{repo}",
-                            "file_path": item["path"],
-                            "language": lang,
-                        },
-                    )
-                )
-                break
-
-    return documents
+
+def detect_language(path: str) -> Optional[str]:
+    for ext, lang in SUPPORTED_EXTS.items():
+        if path.endswith(ext):
+            return lang
+    return None
+
+
+def make_document(
+    repo_name: str,
+    path: str,
+    code: str,
+    blob_sha: Optional[str] = None,
+    commit: Optional[str] = None,
+) -> Document:
+    return Document(
+        text=code,
+        metadata={
+            "repo": repo_name,
+            "file_path": path,
+            "language": detect_language(path),
+            "blob_sha": blob_sha,
+            # Commit the file was indexed from (unchanged files keep their older one)
+            "commit": commit,
+        },
+        # Provenance only: keep it out of the embedded / prompted text
+        excluded_embed_metadata_keys=["blob_sha", "commit"],
+        excluded_llm_metadata_keys=["blob_sha", "commit"],
+    )
+
+
+def _fetch_document(owner: str, repo: str, item: Dict[str, Any], token: Optional[str], session, ref):
+    code = fetch_file(owner, repo, item["path"], token, session=session, ref=ref)
+    return make_document(f"{owner}/{repo}", item["path"], code, blob_sha=item.get("sha"), commit=ref)
+
+
+def iter_documents(
+    owner: str,
+    repo: str,
+    tree: List[Dict[str, Any]],
+    token: Optional[str],
+    concurrency: Optional[int] = None,
+    ref: Optional[str] = None,
+) -> Iterator[Document]:
+    """
+    Fetches supported files concurrently and yields Documents as they arrive
+    (completion order, not tree order). At most `concurrency` requests are in
+    flight and at most 2x that many results are buffered.
+    """
+    concurrency = concurrency or settings.GITHUB_FETCH_CONCURRENCY
+    session = get_http_session(concurrency)
+
+    blobs = iter(
+        item for item in tree
+        if item["type"] == "blob" and detect_language(item["path"])
+    )
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        def submit(item):
+            future = pool.submit(_fetch_document, owner, repo, item, token, session, ref)
+            pending[future] = item
+
+        pending = {}
+        for item in islice(blobs, concurrency * 2):
+            submit(item)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                for next_item in islice(blobs, 1):
+                    submit(next_item)
+
+                try:
+                    yield future.result()
+                except Exception as e:
+                    print(f"  ⚠️ Could not fetch {item['path']}: {e}")
+
+
+def build_documents(
+    owner: str,
+    repo: str,
+    tree: List[Dict[str, Any]],
+    token: Optional[str],
+    concurrency: Optional[int] = None,
+):
+    return list(iter_documents(owner, repo, tree, token, concurrency=concurrency))
@@ -1,6 +1,12 @@
 import requests
 import base64
-from typing import Optional, Dict
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Dict, Iterator, List, Tuple
+from urllib.parse import quote, urlencode
+
+from requests.adapters import HTTPAdapter
 
 from config import settings
 
@@ -16,22 +22,208 @@ def github_headers(token: Optional[str]):
     return headers
 
 
-def fetch_pull_requests(repo: str, token: Optional[str]):
-    url = f"{settings.GITHUB_API}/repos/{repo}/pulls"
-    r = requests.get(url, headers=github_headers(token))
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# Shared across worker threads: once one request hits the rate limit,
+# every other request waits until the limit resets instead of hammering the API.
+_pause_until = 0.0
+_pause_lock = threading.Lock()
+
+
+def get_http_session(pool_size: Optional[int] = None) -> requests.Session:
+    """
+    Returns a process-wide requests.Session with a connection pool sized for
+    concurrent fetches, so every call reuses keep-alive connections.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = pool_size or settings.GITHUB_FETCH_CONCURRENCY
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def _rate_limit_wait(r: requests.Response, attempt: int) -> Optional[float]:
+    """
+    Returns how long to wait before retrying, or None if the response
+    is not a rate-limit response.
+    """
+    if r.status_code not in (403, 429):
+        return None
+
+    retry_after = r.headers.get("Retry-After")
+    if retry_after:
+        return float(retry_after)
+
+    if r.headers.get("X-RateLimit-Remaining") == "0":
+        reset = float(r.headers.get("X-RateLimit-Reset", time.time() + 60))
+        return max(reset - time.time(), 1.0)
+
+    if r.status_code == 429 or "rate limit" in r.text.lower():
+        # Secondary rate limit without a hint: exponential backoff
+        return 60.0 * (2 ** attempt)
+
+    return None
+
+
+def _wait_for_pause():
+    delay = _pause_until - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def github_get(
+    url: str,
+    token: Optional[str],
+    session: Optional[requests.Session] = None,
+    params: Optional[Dict] = None,
+    headers: Optional[Dict] = None,
+    **kwargs,
+) -> requests.Response:
+    """
+    GET against the GitHub API through the pooled session.
+    Backs off (and pauses all other workers) when the rate limit is hit.
+    """
+    global _pause_until
+    session = session or get_http_session()
+    request_headers = github_headers(token)
+    if headers:
+        request_headers.update(headers)
+
+    for attempt in range(settings.GITHUB_MAX_RETRIES + 1):
+        _wait_for_pause()
+        r = session.get(
+            url,
+            headers=request_headers,
+            params=params,
+            timeout=settings.GITHUB_TIMEOUT,
+            **kwargs,
+        )
+
+        wait = _rate_limit_wait(r, attempt)
+        if wait is None or attempt == settings.GITHUB_MAX_RETRIES:
+            return r
+
+        wait = min(wait, settings.GITHUB_MAX_BACKOFF)
+        with _pause_lock:
+            _pause_until = max(_pause_until, time.time() + wait)
+        print(f"  ⏳ GitHub rate limit hit, backing off {wait:.0f}s...")
+
+    return r
+
+
+# {request key: (ETag, Last-Modified)} - loaded from / saved to the DB by the caller
+ETagCache = Dict[str, Tuple[Optional[str], Optional[str]]]
+
+
+def parse_github_time(value: Optional[str]) -> Optional[datetime]:
+    """GitHub timestamps ("2024-01-01T12:00:00Z") as naive UTC datetimes, like the DB stores them."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def iter_pages(
+    url: str,
+    token: Optional[str],
+    params: Optional[Dict] = None,
+    etags: Optional[ETagCache] = None,
+) -> Iterator[list]:
+    """
+    Yields each page of a list endpoint, following Link: rel="next".
+
+    With `etags`, the first page is sent with If-None-Match / If-Modified-Since;
+    a 304 (which does not count against the rate limit) yields nothing.
+    Validators are only remembered for single-page results, since page 1's
+    ETag says nothing about later pages.
+    """
+    key = f"{url}?{urlencode(sorted((params or {}).items()))}"
+    headers = {}
+    if etags is not None and key in etags:
+        etag, last_modified = etags[key]
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    r = github_get(url, token, params=params, headers=headers)
+    if r.status_code == 304:
+        return
     r.raise_for_status()
-    return r.json()
 
+    next_url = r.links.get("next", {}).get("url")
+    if etags is not None:
+        if next_url:
+            etags.pop(key, None)
+        else:
+            etags[key] = (r.headers.get("ETag"), r.headers.get("Last-Modified"))
+
+    yield r.json()
+
+    while next_url:
+        r = github_get(next_url, token)
+        r.raise_for_status()
+        yield r.json()
+        next_url = r.links.get("next", {}).get("url")
+
+
+def fetch_pull_requests(
+    repo: str,
+    token: Optional[str],
+    state: str = "open",
+    since: Optional[datetime] = None,
+    etags: Optional[ETagCache] = None,
+) -> List[dict]:
+    """
+    All PRs of the repo, most recently updated first, each once.
+    Stops paging at the first PR not updated after `since`.
+
+    A PR updated while we page moves to the front and shifts the others
+    down, so a PR can show up on two pages; the fresher copy is kept.
+    """
+    url = f"{settings.GITHUB_API}/repos/{repo}/pulls"
+    params = {"state": state, "sort": "updated", "direction": "desc", "per_page": 100}
+
+    prs: Dict[int, dict] = {}
+
+    def add(pr):
+        seen = prs.get(pr["number"])
+        if seen is None or parse_github_time(pr["updated_at"]) >= parse_github_time(seen["updated_at"]):
+            prs[pr["number"]] = pr
+
+    for page in iter_pages(url, token, params=params, etags=etags):
+        for pr in page:
+            if since and parse_github_time(pr["updated_at"]) <= since:
+                return list(prs.values())
+            add(pr)
+    return list(prs.values())
 
-def fetch_pr_files(repo: str, pr_number: int, token: Optional[str]):
+
+def fetch_pr_files(
+    repo: str,
+    pr_number: int,
+    token: Optional[str],
+    etags: Optional[ETagCache] = None,
+) -> Optional[List[dict]]:
+    """
+    All changed files of a PR (paginated). Returns None when the
+    conditional request says the list is unchanged.
+    """
     url = f"{settings.GITHUB_API}/repos/{repo}/pulls/{pr_number}/files"
-    r = requests.get(url, headers=github_headers(token))
-    r.raise_for_status()
-    return r.json()
+
+    pages = list(iter_pages(url, token, params={"per_page": 100}, etags=etags))
+    if not pages:
+        return None
+    return [f for page in pages for f in page]
 
 
 def fetch_raw_file(raw_url: str, token: Optional[str]):
-    r = requests.get(raw_url, headers=github_headers(token))
+    r = github_get(raw_url, token)
     r.raise_for_status()
     return r.text
 
@@ -39,20 +231,42 @@ def fetch_raw_file(raw_url: str, token: Optional[str]):
 
 
 
+def resolve_commit(owner: str, repo: str, ref: str, token: Optional[str]) -> str:
+    """Commit SHA a branch / tag / SHA currently points to."""
+    url = f"{settings.GITHUB_API}/repos/{owner}/{repo}/commits/{quote(ref)}"
+
+    r = github_get(url, token, headers={"Accept": "application/vnd.github.sha"})
+    r.raise_for_status()
+    return r.text.strip()
+
+
 def get_repo_tree(owner: str, repo: str, token: Optional[str], branch="main"):
-    url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/{branch}?recursive=1"
+    """
+    (entries, truncated). GitHub cuts recursive trees at 100,000 entries /
+    7 MB; a truncated listing is missing files, so it cannot tell which
+    files were removed.
+    """
+    url = f"{settings.GITHUB_API}/repos/{owner}/{repo}/git/trees/{branch}"
 
-    r = requests.get(url, headers=github_headers(token))
+    r = github_get(url, token, params={"recursive": 1})
     r.raise_for_status()
-    return r.json()["tree"]
+    data = r.json()
+    return data["tree"], bool(data.get("truncated"))
 
 
-def fetch_file(owner: str, repo: str, path: str, token: Optional[str]):
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
+def fetch_file(
+    owner: str,
+    repo: str,
+    path: str,
+    token: Optional[str],
+    session: Optional[requests.Session] = None,
+    ref: Optional[str] = None,
+):
+    url = f"{settings.GITHUB_API}/repos/{owner}/{repo}/contents/{quote(path)}"
+    params = {"ref": ref} if ref else None
 
-    r = requests.get(url, headers=github_headers(token))
+    r = github_get(url, token, session=session, params=params)
     r.raise_for_status()
 
     content = r.json()["content"]
     return base64.b64decode(content).decode("utf-8", errors="ignore")
-
@@ -0,0 +1,105 @@
+import posixpath
+import re
+from typing import List, Optional
+
+# Import statements per language, normalized to "/"-separated path keys.
+# Shared by the lexical index (chunk level) and the dependency graph (file level).
+_PY_IMPORT = re.compile(r"^[ \t]*import[ \t]+([\w. \t,]+)", re.M)
+_PY_FROM = re.compile(r"^[ \t]*from[ \t]+(\.*[\w.]*)[ \t]+import[ \t]+(?:\(([^)]*)\)|([\w. \t,*]+))", re.M)
+_JS_IMPORT = re.compile(r"""(?:\bfrom\s+|\bimport\s+|\brequire\s*\(\s*|\bimport\s*\(\s*)['"]([^'"]+)['"]""")
+_JAVA_IMPORT = re.compile(r"^\s*import\s+(?:static\s+)?([\w.]+)\s*;", re.M)
+_GO_IMPORT = re.compile(r'^\s*(?:import\s+)?(?:[\w.]+\s+)?"([^"]+)"', re.M)
+
+
+def _strip_ext(path: str) -> str:
+    root, _ = posixpath.splitext(path)
+    return root
+
+
+def module_key(file_path: str, language: Optional[str] = None) -> str:
+    """
+    Path-like key other files use to import `file_path`:
+    the path without extension ("pkg/mod" for pkg/mod.py, "pkg" for
+    pkg/__init__.py or src/pkg/index.ts) and the directory for Go packages.
+    """
+    if (language or "") == "go" or file_path.endswith(".go"):
+        return posixpath.dirname(file_path)
+    key = _strip_ext(file_path)
+    if posixpath.basename(key) in ("__init__", "index"):
+        key = posixpath.dirname(key)
+    return key
+
+
+def _py_name(part: str) -> str:
+    """ "pkg.mod as m" -> "pkg.mod" """
+    words = part.split()
+    return words[0] if words else ""
+
+
+def import_keys(text: str, language: str, file_path: str) -> List[str]:
+    """Imported modules of a chunk, normalized to "/"-separated keys comparable with module_key()."""
+    keys = []
+    directory = posixpath.dirname(file_path)
+
+    if language == "python":
+        for match in _PY_IMPORT.finditer(text):
+            keys += [_py_name(m).replace(".", "/") for m in match.group(1).split(",")]
+        for match in _PY_FROM.finditer(text):
+            module = match.group(1)
+            names = [_py_name(n) for n in (match.group(2) or match.group(3)).split(",")]
+            level = len(module) - len(module.lstrip("."))
+            base = module.lstrip(".").replace(".", "/")
+            if level:
+                # from . import x / from ..pkg import y: relative to this file's package
+                anchor = directory
+                for _ in range(level - 1):
+                    anchor = posixpath.dirname(anchor)
+                base = posixpath.join(anchor, base) if base else anchor
+            if base:
+                keys.append(base)
+            keys += [
+                posixpath.join(base, name) if base else name
+                for name in names
+                if name and name != "*"
+            ]
+
+    elif language in ("javascript", "typescript"):
+        for match in _JS_IMPORT.finditer(text):
+            spec = match.group(1)
+            if spec.startswith("."):
+                spec = posixpath.normpath(posixpath.join(directory, spec))
+            spec = _strip_ext(spec) if posixpath.splitext(spec)[1] in (".js", ".ts", ".jsx", ".tsx", ".mjs") else spec
+            if posixpath.basename(spec) == "index":
+                spec = posixpath.dirname(spec)
+            keys.append(spec)
+
+    elif language == "java":
+        keys += [m.group(1).replace(".", "/") for m in _JAVA_IMPORT.finditer(text)]
+
+    elif language == "go":
+        # Only inside import declarations
+        for block in re.findall(r"^import\s*(\([^)]*\)|\"[^\"]+\")", text, re.M):
+            keys += [m.group(1) for m in _GO_IMPORT.finditer(block.strip("()"))]
+
+    return [k for k in dict.fromkeys(keys) if k and not k.startswith("..")]
+
+
+def import_suffixes(key: str) -> List[str]:
+    """
+    Keys an import is stored under: "src/pkg/mod" -> ["src/pkg/mod", "pkg/mod"]
+    (at least two components unless the key has only one), so imports match
+    files regardless of source roots such as src/.
+    """
+    parts = [p for p in key.split("/") if p]
+    if len(parts) <= 1:
+        return parts
+    return ["/".join(parts[i:]) for i in range(len(parts) - 1)]
+
+
+def target_keys(file_path: str) -> List[str]:
+    """
+    Import keys that may refer to `file_path`: every suffix of its module key,
+    down to the bare module name ("src/pkg/mod.py" -> "src/pkg/mod", "pkg/mod", "mod").
+    """
+    parts = [p for p in module_key(file_path).split("/") if p]
+    return ["/".join(parts[i:]) for i in range(len(parts))]
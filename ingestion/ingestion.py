@@ -4,58 +4,304 @@
     #  store : file_path , chunk_id , code_snippet, embedding_vector, language, repo_commit etc.
 # provide sql migrations(if using sql dbs)/ schema; store provenance (commit sha, url)
 
-from typing import Optional
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Iterator, List, Tuple
 from config import settings
-from ingestion.github_api import get_repo_tree
-from ingestion.document import build_documents
+from ingestion.github_api import get_repo_tree, resolve_commit
+from ingestion.document import iter_documents, detect_language
+from ingestion.archive import iter_archive_documents, iter_local_documents
 from ingestion.splitter import split_code_safely
+from ingestion.dedup import ChunkDeduplicator, exclusion_reason, document_exclusion_reason
+from ingestion.manifest import load_manifest, plan_changes, stale_point_ids, update_manifest
+from ingestion.dependencies import document_imports, graph_built, mark_graph_built, update_dependencies
+from ingestion.pipeline import IngestionPipeline
+from database import session_scope
 from vector_store import VectorStore
-import requests
+from embedding_cache import CachedEmbedding
+from lexical_index import get_lexical_index
 
-from llama_index.core import VectorStoreIndex,StorageContext
-from llama_index.embeddings.openai import OpenAIEmbedding
+from llama_index.core import Document
 
 
 
 
-def run_ingestion(owner: str, repo: str, branch: str, token: Optional[str]):
+def load_documents(
+    owner: str,
+    repo: str,
+    branch: str,
+    token: Optional[str],
+    current: Dict[str, str],
+    mode: str = "api",
+    local_path: Optional[str] = None,
+    known: Optional[Dict[str, str]] = None,
+) -> Iterator[Document]:
+    """
+    Streams the repository as Documents.
+      - "api":     tree + one contents-API request per file
+      - "archive": one tarball download, streamed in memory
+      - "local":   read from a local clone / path (offline)
+
+    `known` maps file_path -> blob SHA already ingested; those files are skipped
+    (in "api" mode they are not even fetched).
+    Yields Documents for new/changed files only, and fills `current` with
+    {file_path: blob_sha} for the whole repo as it goes.
+
+    Vendored / generated / oversized files (see ingestion.dedup) are left out
+    of both, so any points they had from earlier runs get deleted.
+    """
+    known = known or {}
+    excluded = 0
+
+    if mode in ("archive", "local"):
+        if mode == "archive":
+            print("🔹 Streaming repository archive...")
+            commit = resolve_commit(owner, repo, branch, token)
+            docs = iter_archive_documents(owner, repo, branch, token, commit=commit)
+        else:
+            if not local_path:
+                raise ValueError("local ingestion mode requires a local_path")
+            print(f"🔹 Reading local checkout at {local_path}...")
+            docs = iter_local_documents(local_path, f"{owner}/{repo}")
+
+        for doc in docs:
+            path, sha = doc.metadata["file_path"], doc.metadata["blob_sha"]
+            if document_exclusion_reason(doc):
+                excluded += 1
+                continue
+            current[path] = sha
+            if known.get(path) != sha:
+                yield doc
+
+        print(f"🔹 Skipped {excluded} excluded file(s)")
+        return
+
+    if mode != "api":
+        raise ValueError(f"Unknown ingestion mode: {mode}")
+
     print("🔹 Fetching repository tree...")
-    tree = get_repo_tree(
+    # Pin tree and file contents to one commit, even if the branch moves meanwhile
+    commit = resolve_commit(owner, repo, branch, token)
+    tree, truncated = get_repo_tree(
         owner,
         repo,
         token,
-        branch,
+        commit,
     )
+    if truncated:
+        # Files missing from the listing would count as removed; the tarball lists them all
+        print("⚠️ Repository tree is truncated, streaming the archive instead")
+        yield from load_documents(owner, repo, branch, token, current, mode="archive", known=known)
+        return
+
+    blobs = []
+    for item in tree:
+        if item["type"] != "blob" or not detect_language(item["path"]):
+            continue
+        if exclusion_reason(item["path"], item.get("size")):
+            excluded += 1
+            continue
+        blobs.append(item)
+    current.update((item["path"], item["sha"]) for item in blobs)
 
-    print("🔹 Building documents...")
-    documents = build_documents(
+    print("🔹 Fetching documents...")
+    for doc in iter_documents(
         owner,
         repo,
-        tree,
+        [item for item in blobs if known.get(item["path"]) != item["sha"]],
         token,
-    )
+        ref=commit,
+    ):
+        # Minified / generated content only shows once the file is fetched
+        if document_exclusion_reason(doc):
+            excluded += 1
+            current.pop(doc.metadata["file_path"], None)
+            continue
+        yield doc
+
+    print(f"🔹 Skipped {excluded} excluded file(s)")
+
+
+def run_ingestion(
+    owner: str,
+    repo: str,
+    branch: str,
+    token: Optional[str],
+    mode: Optional[str] = None,
+    local_path: Optional[str] = None,
+    full: bool = False,
+    split_workers: Optional[int] = None,
+):
+    """
+    Incremental by default: only files whose blob SHA differs from the
+    ingestion manifest are fetched, split and embedded, and the points of
+    changed / removed files are deleted. Pass full=True to rebuild everything;
+    that also happens when the lexical index or import graph of a repo with
+    a manifest was never built (ingested before they existed), since both
+    are only filled for the files a run processes.
+
+    Files stream through fetch -> split -> embed -> upsert (see IngestionPipeline),
+    so memory stays bounded and indexing starts with the first file.
+    """
+    repo_name = f"{owner}/{repo}"
+
+    lexical_index = get_lexical_index() if settings.LEXICAL_INDEX_ENABLED else None
+
+    # Short-lived sessions: no pooled connection is held while files stream
+    with session_scope() as db:
+        manifest = load_manifest(db, repo_name)
+        # Detach the rows so they stay readable after the session closes
+        db.expunge_all()
+        missing_graph = bool(manifest) and not graph_built(db, repo_name)
 
-    print(f"🔹 Loaded {len(documents)} files")
+    missing_lexical = bool(manifest) and lexical_index is not None and not lexical_index.is_built(repo_name)
+    if not full and (missing_graph or missing_lexical):
+        missing = " and ".join(
+            name for name, flag in (("import graph", missing_graph), ("lexical index", missing_lexical)) if flag
+        )
+        print(f"🔹 {repo_name} has no {missing} yet, re-indexing every file...")
+        full = True
 
-    nodes = split_code_safely(documents, language="python")
+    known = {} if full else {path: m.blob_sha for path, m in manifest.items()}
+    current: Dict[str, str] = {}
+    fetched = set()
+    imports: Dict[str, List[str]] = {}
 
-    print(f"🔹 Created {len(nodes)} code chunks")
+    def documents():
+        for doc in load_documents(
+            owner,
+            repo,
+            branch,
+            token,
+            current,
+            mode=mode or settings.INGESTION_MODE,
+            local_path=local_path or settings.INGESTION_LOCAL_PATH,
+            known=known,
+        ):
+            fetched.add(doc.metadata["file_path"])
+            imports[doc.metadata["file_path"]] = document_imports(doc)
+            yield doc
 
-    vector_client = VectorStore()
-    embed_model = vector_client.embed
-    vector_store = vector_client.vector_store
+    vector_client = VectorStore(repo_name)
 
-    print("🔹 Storing embeddings in Qdrant...")
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    index = VectorStoreIndex.from_documents(
-        documents=[],
-        storage_context=storage_context,
-        embed_model=embed_model,
+    if not manifest:
+        # Points written before the manifest existed (or by a run that never
+        # recorded them) are not tracked by any entry and would stay next to
+        # the re-ingested copies; start this repo from a clean slate.
+        print(f"🔹 No manifest for {repo_name} yet, removing any untracked points...")
+        vector_client.delete_repo_points()
+        if lexical_index is not None:
+            lexical_index.delete_repo(repo_name)
+
+    dedup = ChunkDeduplicator() if settings.INGEST_DEDUP_ENABLED else None
+    pipeline = IngestionPipeline(
+        embed_model=vector_client.embed,
+        vector_store=vector_client.vector_store,
+        split_fn=split_code_safely,
+        split_workers=split_workers,
+        dedup=dedup,
+        lexical_index=lexical_index,
     )
-    print(f"🔹 Inserting {len(nodes)} nodes into the index...")
-    print(f"nodes sample: {nodes[0].get_text()}")
-    index.insert_nodes(nodes)
+
+    print("🔹 Streaming files through split -> embed -> upsert...")
+    point_ids = pipeline.run(documents())
+    pipeline.report()
+
+    # Until the manifest lists the new points, a failure must take them back out
+    try:
+        changed, removed = plan_changes(current, manifest)
+        if full:
+            changed = set(current)
+        # Files that failed to fetch keep their previous manifest entry / points
+        changed &= fetched
+        # Every file of the repo went through this run, so the derived indexes are complete
+        rebuilt = (full or not manifest) and not set(current) - fetched
+
+        print(
+            f"🔹 {len(current)} files in repo: {len(changed)} new/changed, "
+            f"{len(removed)} removed, {len(current) - len(changed)} unchanged"
+        )
+
+        # A file whose chunks were dropped as duplicates lists the points standing in for them
+        shared = dedup.references(point_ids) if dedup else {}
+        ingested = {
+            path: (current[path], point_ids.get(path, []) + shared.get(path, []))
+            for path in changed
+        }
+        stale = stale_point_ids(manifest, changed | removed)
+
+        with session_scope() as db:
+            update_manifest(db, repo_name, ingested, removed)
+            # Import edges follow the same blob SHA changes as the manifest
+            update_dependencies(db, repo_name, {path: imports.get(path, []) for path in changed}, removed)
+            if rebuilt:
+                mark_graph_built(db, repo_name)
+    except BaseException:
+        pipeline.rollback([i for ids in point_ids.values() for i in ids])
+        raise
+
+    if rebuilt and lexical_index is not None:
+        lexical_index.mark_built(repo_name)
+
+    # The manifest now points at the new points; drop the ones they replace
+    if stale:
+        print(f"🔹 Deleting {len(stale)} stale points...")
+        try:
+            vector_client.delete_points(stale)
+            if lexical_index is not None:
+                lexical_index.delete(stale)
+        except Exception as e:
+            print(f"⚠️ Could not delete {len(stale)} stale point(s) ({e}); a full re-ingestion removes them")
+
+    if isinstance(vector_client.embed, CachedEmbedding):
+        stats = vector_client.embed.cache.stats()
+        print(
+            f"🔹 Embedding cache: {stats['hits']} hits / {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%}), {stats['entries']} entries"
+        )
 
     print("✅ Ingestion complete")
 
 
+def configured_repos() -> List[Tuple[str, str, str]]:
+    """(owner, repo, branch) for every INGEST_REPOS entry ("owner/repo[@branch]")."""
+    repos = []
+    for spec in settings.INGEST_REPOS or [settings.GITHUB_REPO]:
+        name, _, branch = spec.partition("@")
+        owner, _, repo = name.strip().partition("/")
+        if not owner or not repo:
+            raise ValueError(f"Invalid INGEST_REPOS entry: {spec!r} (expected owner/repo[@branch])")
+        repos.append((owner, repo, branch.strip() or "main"))
+    return repos
+
+
+def ingest_repos(
+    repos: Optional[List[Tuple[str, str, str]]] = None,
+    token: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    full: bool = False,
+) -> Dict[str, Optional[str]]:
+    """
+    Ingests several repositories side by side (INGEST_REPO_CONCURRENCY at a time).
+    A failing repo does not stop the others. full=True re-indexes every file.
+    Returns {"owner/repo": None on success, else the error message}.
+    """
+    repos = repos or configured_repos()
+    token = token or settings.GITHUB_TOKEN
+    concurrency = max(1, min(concurrency or settings.INGEST_REPO_CONCURRENCY, len(repos)))
+    # Each pipeline starts its own split pool; together they should not exceed the CPUs
+    split_workers = settings.INGEST_SPLIT_WORKERS or max(1, (os.cpu_count() or 1) // concurrency)
+
+    def ingest(spec):
+        owner, repo, branch = spec
+        try:
+            run_ingestion(owner, repo, branch, token, full=full, split_workers=split_workers)
+            return None
+        except Exception as e:
+            print(f"❌ Ingestion of {owner}/{repo} failed: {e}")
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        errors = list(pool.map(ingest, repos))
+
+    return {f"{owner}/{repo}": error for (owner, repo, _), error in zip(repos, errors)}
@@ -0,0 +1,78 @@
+import hashlib
+from typing import Dict, List, Set, Tuple
+
+from database import IngestionManifest
+
+
+def git_blob_sha(data: bytes) -> str:
+    """Same SHA git (and the trees API) assigns to a blob with this content."""
+    header = f"blob {len(data)}\0".encode()
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def load_manifest(db, repo: str) -> Dict[str, IngestionManifest]:
+    rows = db.query(IngestionManifest).filter_by(repo=repo).all()
+    return {row.file_path: row for row in rows}
+
+
+def plan_changes(
+    current: Dict[str, str],
+    manifest: Dict[str, IngestionManifest],
+) -> Tuple[Set[str], Set[str]]:
+    """
+    Compares the current {file_path: blob_sha} against the manifest.
+    Returns (added_or_changed, removed) file paths.
+    """
+    changed = {
+        path for path, sha in current.items()
+        if path not in manifest or manifest[path].blob_sha != sha
+    }
+    removed = set(manifest) - set(current)
+    return changed, removed
+
+
+def stale_point_ids(manifest: Dict[str, IngestionManifest], paths: Set[str]) -> List[str]:
+    """
+    Points of `paths`' entries that no other entry still lists. Deduplicated
+    content is stored once and listed under every file that has it, so a
+    point outlives the file that wrote it while another file uses it.
+    """
+    in_use = {
+        point_id
+        for path, entry in manifest.items() if path not in paths
+        for point_id in entry.point_ids or []
+    }
+    ids = []
+    for path in paths:
+        entry = manifest.get(path)
+        if entry and entry.point_ids:
+            ids.extend(i for i in entry.point_ids if i not in in_use)
+    return list(dict.fromkeys(ids))
+
+
+def update_manifest(
+    db,
+    repo: str,
+    ingested: Dict[str, Tuple[str, List[str]]],
+    removed: Set[str],
+):
+    """
+    ingested: {file_path: (blob_sha, point_ids)} for every file that was (re)indexed.
+    removed:  file paths that no longer exist in the repo.
+    Does not commit.
+    """
+    for path, (sha, point_ids) in ingested.items():
+        db.merge(IngestionManifest(
+            repo=repo,
+            file_path=path,
+            blob_sha=sha,
+            point_ids=point_ids,
+        ))
+
+    if removed:
+        (
+            db.query(IngestionManifest)
+            .filter(IngestionManifest.repo == repo)
+            .filter(IngestionManifest.file_path.in_(removed))
+            .delete(synchronize_session=False)
+        )
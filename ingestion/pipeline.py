@@ -0,0 +1,291 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+from llama_index.core import Document
+from llama_index.core.schema import BaseNode, MetadataMode
+
+from config import settings
+from ingestion.dedup import ChunkDeduplicator
+
+_DONE = object()
+
+
+def _timed_split(split_fn, documents):
+    """Runs in a split worker process; returns the nodes and the CPU time spent."""
+    started = time.perf_counter()
+    nodes = split_fn(documents)
+    return nodes, time.perf_counter() - started
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    items: int = 0
+    busy_seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.busy_seconds if self.busy_seconds else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.name:<7} {self.items:>7} items in {self.busy_seconds:7.1f}s "
+            f"({self.throughput:.1f}/s)"
+        )
+
+
+class IngestionPipeline:
+    """
+    fetch -> split -> embed (batched) -> upsert (batched)
+
+    Each stage runs in its own thread(s) and hands work to the next through a
+    bounded queue, so network, embedding and Qdrant writes overlap and at most
+    `queue_size` items per stage are held in memory.
+
+    Splitting is CPU-bound, so with split_workers > 1 it is farmed out to a
+    process pool; split_fn must then be a picklable module-level function.
+    With a `dedup`, duplicate files and chunks are dropped before embedding.
+    With a `lexical_index`, every chunk written to Qdrant is indexed there too.
+    """
+
+    def __init__(
+        self,
+        embed_model,
+        vector_store,
+        split_fn: Callable[[List[Document]], List[BaseNode]],
+        embed_batch_size: Optional[int] = None,
+        upsert_batch_size: Optional[int] = None,
+        embed_workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        split_workers: Optional[int] = None,
+        dedup: Optional[ChunkDeduplicator] = None,
+        lexical_index=None,
+    ):
+        self.embed_model = embed_model
+        self.vector_store = vector_store
+        self.split_fn = split_fn
+        self.embed_batch_size = embed_batch_size or settings.INGEST_EMBED_BATCH_SIZE
+        self.upsert_batch_size = upsert_batch_size or settings.INGEST_UPSERT_BATCH_SIZE
+        self.embed_workers = embed_workers or settings.INGEST_EMBED_WORKERS
+        self.queue_size = queue_size or settings.INGEST_QUEUE_SIZE
+        self.split_workers = split_workers or settings.INGEST_SPLIT_WORKERS or os.cpu_count() or 1
+        self.dedup = dedup
+        self.lexical_index = lexical_index
+
+        self.metrics = {
+            name: StageMetrics(name) for name in ("fetch", "split", "embed", "upsert")
+        }
+        self._metrics_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+
+    # -- queue helpers (never block forever once a stage has failed) --------
+    def _put(self, q: queue.Queue, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _record(self, stage: str, items: int, started: float):
+        with self._metrics_lock:
+            m = self.metrics[stage]
+            m.items += items
+            m.busy_seconds += time.perf_counter() - started
+
+    def _guard(self, fn, *args):
+        try:
+            fn(*args)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    # -- stages --------------------------------------------------------------
+    def _fetch(self, documents: Iterable[Document], out_q: queue.Queue):
+        it = iter(documents)
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            doc = next(it, _DONE)
+            if doc is _DONE:
+                break
+            self._record("fetch", 1, started)
+            self._put(out_q, doc)
+        self._put(out_q, _DONE)
+
+    def _split(self, in_q: queue.Queue, out_q: queue.Queue):
+        batch = []
+
+        def emit(nodes, seconds):
+            nonlocal batch
+            with self._metrics_lock:
+                m = self.metrics["split"]
+                m.items += len(nodes)
+                m.busy_seconds += seconds
+
+            if self.dedup:
+                nodes = self.dedup.filter(nodes)
+            for node in nodes:
+                batch.append(node)
+                if len(batch) >= self.embed_batch_size:
+                    self._put(out_q, batch)
+                    batch = []
+
+        if self.split_workers <= 1:
+            while True:
+                doc = self._get(in_q)
+                if doc is _DONE:
+                    break
+                if self.dedup and self.dedup.is_duplicate_file(doc):
+                    continue
+                emit(*_timed_split(self.split_fn, [doc]))
+        else:
+            # "spawn": forking a process that runs several threads is unsafe
+            pool = ProcessPoolExecutor(
+                max_workers=self.split_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            in_flight = set()
+            try:
+                while True:
+                    doc = self._get(in_q)
+                    if doc is _DONE:
+                        break
+                    if self.dedup and self.dedup.is_duplicate_file(doc):
+                        continue
+                    in_flight.add(pool.submit(_timed_split, self.split_fn, [doc]))
+
+                    # Keep every worker busy, but don't read ahead without bound
+                    if len(in_flight) >= 2 * self.split_workers:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            emit(*future.result())
+
+                for future in in_flight:
+                    emit(*future.result())
+            finally:
+                pool.shutdown(cancel_futures=True)
+
+        if batch:
+            self._put(out_q, batch)
+        for _ in range(self.embed_workers):
+            self._put(out_q, _DONE)
+
+    def _embed(self, in_q: queue.Queue, out_q: queue.Queue):
+        while True:
+            batch = self._get(in_q)
+            if batch is _DONE:
+                break
+
+            started = time.perf_counter()
+            texts = [n.get_content(metadata_mode=MetadataMode.EMBED) for n in batch]
+            embeddings = self.embed_model.get_text_embedding_batch(texts)
+            for node, embedding in zip(batch, embeddings):
+                node.embedding = embedding
+            self._record("embed", len(batch), started)
+
+            self._put(out_q, batch)
+        self._put(out_q, _DONE)
+
+    def _upsert(self, in_q: queue.Queue, point_ids: Dict[str, List[str]]):
+        pending = []
+        finished_workers = 0
+
+        def flush():
+            started = time.perf_counter()
+            self.vector_store.add(pending)
+            # Recorded as soon as they exist, so a later failure can roll them back
+            for node in pending:
+                point_ids[node.metadata["file_path"]].append(node.node_id)
+            if self.lexical_index is not None:
+                self.lexical_index.add_nodes(pending)
+            self._record("upsert", len(pending), started)
+            pending.clear()
+
+        while finished_workers < self.embed_workers:
+            batch = self._get(in_q)
+            if batch is _DONE:
+                if self._stop.is_set():
+                    return
+                finished_workers += 1
+                continue
+
+            pending.extend(batch)
+            if len(pending) >= self.upsert_batch_size:
+                flush()
+
+        if pending:
+            flush()
+
+    # -- entrypoint ----------------------------------------------------------
+    def run(self, documents: Iterable[Document]) -> Dict[str, List[str]]:
+        """
+        Streams documents through the pipeline.
+        Returns {file_path: [point ids written]}.
+        """
+        docs_q = queue.Queue(maxsize=self.queue_size)
+        nodes_q = queue.Queue(maxsize=self.queue_size)
+        embedded_q = queue.Queue(maxsize=self.queue_size)
+        point_ids: Dict[str, List[str]] = defaultdict(list)
+
+        threads = [
+            threading.Thread(target=self._guard, args=(self._fetch, documents, docs_q), name="ingest-fetch"),
+            threading.Thread(target=self._guard, args=(self._split, docs_q, nodes_q), name="ingest-split"),
+        ]
+        threads += [
+            threading.Thread(target=self._guard, args=(self._embed, nodes_q, embedded_q), name=f"ingest-embed-{i}")
+            for i in range(self.embed_workers)
+        ]
+
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        self._guard(self._upsert, embedded_q, point_ids)
+        self._stop.set()
+        for t in threads:
+            t.join()
+
+        if self._errors:
+            self.rollback([i for ids in point_ids.values() for i in ids])
+            raise self._errors[0]
+
+        return dict(point_ids)
+
+    def rollback(self, node_ids: List[str]):
+        """
+        Deletes points written by a run whose results never reached the
+        manifest; the next run would re-insert those files under new ids and
+        leave these behind as duplicates.
+        """
+        if not node_ids:
+            return
+        print(f"   ↩️  Ingestion failed, deleting {len(node_ids)} point(s) written so far")
+        try:
+            self.vector_store.delete_nodes(node_ids=node_ids)
+            if self.lexical_index is not None:
+                self.lexical_index.delete(node_ids)
+        except Exception as e:
+            print(f"   ⚠️ Rollback failed ({e}); the next full ingestion will clean them up")
+
+    def report(self):
+        # split time is summed over worker processes
+        for m in self.metrics.values():
+            print(f"   {m}")
+        if self.dedup:
+            self.dedup.report()
@@ -1,28 +1,71 @@
-
+from functools import lru_cache
+from itertools import groupby
 from llama_index.core.node_parser import CodeSplitter, SentenceSplitter
 import logging
 
 logger = logging.getLogger(__name__)
 
-def split_code_safely(documents, language="python"):
-    try:
-        splitter = CodeSplitter(
-            language=language,
-            chunk_lines=60,
-            chunk_lines_overlap=10,
-            max_chars=1500,
-        )
-        return splitter.get_nodes_from_documents(documents)
-
-    except Exception as e:
-        logger.warning(
-            f"CodeSplitter failed for language={language}, "
-            f"falling back to SentenceSplitter. Error: {e}"
-        )
-
-        fallback = SentenceSplitter(
-            chunk_size=800,
-            chunk_overlap=120,
-            separator="\n",
-        )
-        return fallback.get_nodes_from_documents(documents)
+
+@lru_cache(maxsize=None)
+def get_code_splitter(language: str) -> CodeSplitter:
+    """One tree-sitter splitter per language and process (parsers are costly to build)."""
+    return CodeSplitter(
+        language=language,
+        chunk_lines=60,
+        chunk_lines_overlap=10,
+        max_chars=1500,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_fallback_splitter() -> SentenceSplitter:
+    return SentenceSplitter(
+        chunk_size=800,
+        chunk_overlap=120,
+        separator="\n",
+    )
+
+
+# Languages whose parser could not be built; don't retry them for every file
+_unsupported = set()
+
+
+def _split_file(document, language):
+    if language and language not in _unsupported:
+        try:
+            splitter = get_code_splitter(language)
+        except Exception as e:
+            _unsupported.add(language)
+            logger.warning(
+                f"No CodeSplitter for language={language}, "
+                f"using SentenceSplitter for these files. Error: {e}"
+            )
+        else:
+            try:
+                return splitter.get_nodes_from_documents([document])
+            except Exception as e:
+                logger.warning(
+                    f"CodeSplitter failed for {document.metadata.get('file_path')} "
+                    f"(language={language}), falling back to SentenceSplitter. Error: {e}"
+                )
+
+    return get_fallback_splitter().get_nodes_from_documents([document])
+
+
+def split_code_safely(documents, language=None):
+    """
+    Splits each document with the CodeSplitter of its own language
+    (metadata["language"], or `language` to force one). A file that
+    tree-sitter cannot handle falls back to SentenceSplitter on its own;
+    the rest of the batch is unaffected.
+
+    Module-level so it can be shipped to a process pool.
+    """
+    def lang(doc):
+        return language or doc.metadata.get("language") or ""
+
+    nodes = []
+    for doc_language, group in groupby(sorted(documents, key=lang), key=lang):
+        for document in group:
+            nodes.extend(_split_file(document, doc_language or None))
+    return nodes
@@ -0,0 +1,306 @@
+import os
+import posixpath
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from llama_index.core.schema import BaseNode, NodeWithScore, TextNode
+
+from config import settings
+from ingestion.imports import import_keys, import_suffixes, module_key, target_keys
+
+# ========================
+# SYMBOL EXTRACTION
+# ========================
+# Cheap line-based patterns: good enough to answer "who defines / imports X"
+_DEFINITIONS = {
+    "python": [r"^\s*(?:async\s+)?def\s+(\w+)", r"^\s*class\s+(\w+)"],
+    "javascript": [
+        r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*(\w+)",
+        r"^\s*(?:export\s+)?(?:default\s+)?class\s+(\w+)",
+        r"^\s*(?:export\s+)?(?:const|let|var)\s+(\w+)\s*=",
+    ],
+    "java": [
+        r"^\s*(?:public|protected|private|abstract|final|static|\s)*(?:class|interface|enum|record)\s+(\w+)",
+        r"^\s*(?:public|protected|private|static|final|synchronized|abstract|\s)+[\w<>\[\], ]+\s+(\w+)\s*\(",
+    ],
+    "go": [r"^func\s+(?:\([^)]*\)\s*)?(\w+)", r"^type\s+(\w+)"],
+}
+_DEFINITIONS["typescript"] = _DEFINITIONS["javascript"] + [
+    r"^\s*(?:export\s+)?(?:interface|type|enum)\s+(\w+)",
+]
+
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def path_terms(file_path: str) -> List[str]:
+    """Search terms for a file: its module name and package (no extension, no leading dirs)."""
+    key = module_key(file_path)
+    return [p for p in key.split("/")[-2:] if p]
+
+
+def extract_symbols(text: str, language: Optional[str], file_path: str) -> Tuple[List[str], List[str]]:
+    """(defined names, import keys) found in a chunk."""
+    language = language or ""
+    definitions = []
+    for pattern in _DEFINITIONS.get(language, []):
+        definitions += re.findall(pattern, text, re.M)
+    return list(dict.fromkeys(definitions)), import_keys(text, language, file_path)
+
+
+def _fts_query(terms: Iterable[str]) -> str:
+    words = dict.fromkeys(w.lower() for term in terms for w in _WORD.findall(term) if len(w) > 1)
+    return " OR ".join(f'"{w}"' for w in words)
+
+
+# ========================
+# INDEX
+# ========================
+class LexicalIndex:
+    """
+    Exact-match side of retrieval, built from the same chunks that go to Qdrant:
+      - an FTS5 table (BM25) over chunk text, file path and defined names,
+      - a symbol table of definitions and imports per chunk.
+    Answers "which code imports these files" without an embedding call.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                node_id TEXT UNIQUE NOT NULL,
+                repo TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                symbols TEXT NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_repo_file ON chunks (repo, file_path);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                file_path, symbols, text,
+                content='chunks', content_rowid='id',
+                tokenize="unicode61 tokenchars '_'"
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts(rowid, file_path, symbols, text)
+                VALUES (new.id, new.file_path, new.symbols, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts(chunks_fts, rowid, file_path, symbols, text)
+                VALUES ('delete', old.id, old.file_path, old.symbols, old.text);
+            END;
+            CREATE TABLE IF NOT EXISTS symbols (
+                repo TEXT NOT NULL,
+                node_id TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS symbols_lookup ON symbols (repo, kind, name);
+            CREATE INDEX IF NOT EXISTS symbols_node ON symbols (node_id);
+            -- Repos whose every file went through add_nodes (a repo may have no chunks)
+            CREATE TABLE IF NOT EXISTS built_repos (repo TEXT PRIMARY KEY);
+        """)
+        self._conn.commit()
+
+    def add_nodes(self, nodes: List[BaseNode]):
+        chunk_rows, symbol_rows = [], []
+        for node in nodes:
+            meta = node.metadata
+            text = node.get_content()
+            definitions, imports = extract_symbols(text, meta.get("language"), meta["file_path"])
+
+            chunk_rows.append((node.node_id, meta["repo"], meta["file_path"], " ".join(definitions), text))
+            symbol_rows += [(meta["repo"], node.node_id, meta["file_path"], "def", d) for d in definitions]
+            symbol_rows += [
+                (meta["repo"], node.node_id, meta["file_path"], "import", suffix)
+                for key in imports
+                for suffix in import_suffixes(key)
+            ]
+
+        with self._lock:
+            self._delete([row[0] for row in chunk_rows])
+            self._conn.executemany(
+                "INSERT INTO chunks (node_id, repo, file_path, symbols, text) VALUES (?, ?, ?, ?, ?)",
+                chunk_rows,
+            )
+            self._conn.executemany(
+                "INSERT INTO symbols (repo, node_id, file_path, kind, name) VALUES (?, ?, ?, ?, ?)",
+                symbol_rows,
+            )
+            self._conn.commit()
+
+    def _delete(self, node_ids: List[str]):
+        for i in range(0, len(node_ids), 500):
+            chunk = node_ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            self._conn.execute(f"DELETE FROM chunks WHERE node_id IN ({marks})", chunk)
+            self._conn.execute(f"DELETE FROM symbols WHERE node_id IN ({marks})", chunk)
+
+    def delete(self, node_ids: List[str]):
+        with self._lock:
+            self._delete(list(node_ids))
+            self._conn.commit()
+
+    def delete_repo(self, repo: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE repo = ?", (repo,))
+            self._conn.execute("DELETE FROM symbols WHERE repo = ?", (repo,))
+            self._conn.execute("DELETE FROM built_repos WHERE repo = ?", (repo,))
+            self._conn.commit()
+
+    def is_built(self, repo: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM built_repos WHERE repo = ?", (repo,)).fetchone()
+        return row is not None
+
+    def mark_built(self, repo: str):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO built_repos (repo) VALUES (?)", (repo,))
+            self._conn.commit()
+
+    @staticmethod
+    def _to_nodes(rows) -> List[NodeWithScore]:
+        return [
+            NodeWithScore(
+                node=TextNode(id_=node_id, text=text, metadata={"repo": repo, "file_path": file_path}),
+                # bm25() is lower-is-better
+                score=-score,
+            )
+            for node_id, repo, file_path, text, score in rows
+        ]
+
+    def search(
+        self,
+        repo: str,
+        terms: Iterable[str],
+        k: int = 6,
+        file_paths: Optional[List[str]] = None,
+    ) -> List[NodeWithScore]:
+        """BM25 over path, defined names and text; file path and names weigh more."""
+        query = _fts_query(terms)
+        if not query:
+            return []
+
+        sql = (
+            "SELECT c.node_id, c.repo, c.file_path, c.text, bm25(chunks_fts, 4.0, 3.0, 1.0)"
+            " FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid"
+            " WHERE chunks_fts MATCH ? AND c.repo = ?"
+        )
+        params: list = [query, repo]
+        if file_paths is not None:
+            if not file_paths:
+                return []
+            sql += f" AND c.file_path IN ({','.join('?' * len(file_paths))})"
+            params += file_paths
+        sql += " ORDER BY 5 LIMIT ?"
+        params.append(k)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return self._to_nodes(rows)
+
+    def find_importers(self, repo: str, file_paths: List[str], k: int = 6) -> List[NodeWithScore]:
+        """
+        Chunks of other files that import any of `file_paths`: call sites
+        first (BM25 on the imported module names within the importing
+        files), then the import statements themselves.
+        """
+        keys: Dict[str, str] = {}
+        for path in file_paths:
+            for key in target_keys(path):
+                keys.setdefault(key, path)
+        if not keys:
+            return []
+
+        marks = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT s.node_id, c.file_path, c.text, length(s.name)"
+                " FROM symbols s JOIN chunks c ON c.node_id = s.node_id"
+                f" WHERE s.repo = ? AND s.kind = 'import' AND s.name IN ({marks})"
+                " ORDER BY 4 DESC",
+                [repo, *keys],
+            ).fetchall()
+
+        changed = set(file_paths)
+        import_rows = [r for r in rows if r[1] not in changed]
+        importing_files = list(dict.fromkeys(r[1] for r in import_rows))
+
+        names = [posixpath.basename(module_key(p)) or posixpath.basename(p) for p in file_paths]
+        call_sites = self.search(repo, names, k=k, file_paths=importing_files)
+
+        seen = {n.node.node_id for n in call_sites}
+        results = list(call_sites)
+        for node_id, file_path, text, matched in import_rows:
+            if node_id not in seen:
+                seen.add(node_id)
+                results.append(NodeWithScore(
+                    node=TextNode(id_=node_id, text=text, metadata={"repo": repo, "file_path": file_path}),
+                    score=float(matched),
+                ))
+        return results[:k]
+
+    def find_definitions(self, repo: str, names: List[str], k: int = 6) -> List[NodeWithScore]:
+        """Chunks that define any of `names` (functions, classes, types)."""
+        if not names:
+            return []
+        marks = ",".join("?" * len(names))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT c.node_id, c.repo, c.file_path, c.text, 0.0"
+                " FROM symbols s JOIN chunks c ON c.node_id = s.node_id"
+                f" WHERE s.repo = ? AND s.kind = 'def' AND s.name IN ({marks}) LIMIT ?",
+                [repo, *names, k],
+            ).fetchall()
+        return self._to_nodes(rows)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            (chunks,) = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()
+            (symbols,) = self._conn.execute("SELECT COUNT(*) FROM symbols").fetchone()
+        return {"chunks": chunks, "symbols": symbols}
+
+
+_index: Optional[LexicalIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_lexical_index() -> LexicalIndex:
+    """Process-wide index so ingestion threads and the workflow share one connection."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = LexicalIndex(settings.LEXICAL_INDEX_PATH)
+        return _index
+
+
+def reciprocal_rank_fusion(
+    result_lists: List[List[NodeWithScore]],
+    k: int = 6,
+    rrf_k: int = 60,
+) -> List[NodeWithScore]:
+    """
+    Merges ranked lists by sum(1 / (rrf_k + rank)) per node id. Scores of
+    different retrievers (cosine, BM25) are not comparable; ranks are.
+    """
+    scores: Dict[str, float] = {}
+    nodes: Dict[str, NodeWithScore] = {}
+    for results in result_lists:
+        for rank, item in enumerate(results, start=1):
+            node_id = item.node.node_id
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (rrf_k + rank)
+            nodes.setdefault(node_id, item)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [NodeWithScore(node=nodes[node_id].node, score=scores[node_id]) for node_id in ranked]
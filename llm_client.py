@@ -1,55 +1,280 @@
+import asyncio
+import hashlib
 import json
+import random
+import threading
 import time
-from typing import Dict, Any
-from openai import OpenAI
+import weakref
+from typing import Dict, Any, Optional
+import openai
+from openai import OpenAI, AsyncOpenAI
 from config import settings
+from cache import DiskCache
+from prompt_builder import count_tokens
 
-# Initialize client
-_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+# Initialize clients (retries are handled below, not by the SDK)
+_client = OpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    base_url=settings.OPENAI_BASE_URL or None,
+    max_retries=0,
+)
+_async_client = AsyncOpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    base_url=settings.OPENAI_BASE_URL or None,
+    max_retries=0,
+)
+
+SYSTEM_PROMPT = "You are a helpful assistant. Output valid JSON only."
 
 class LLMError(Exception):
     """Raised when LLM generation fails"""
 
-def generate_json(prompt: str, max_retries: int = 3) -> Dict[str, Any]:
+
+# ========================
+# RATE LIMITING
+# ========================
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute, up to a burst of `per_minute`.
+    reserve() never blocks: it books the units and returns how long the
+    caller must wait, so the same bucket serves threads and coroutines.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+
+_request_bucket = TokenBucket(settings.LLM_REQUESTS_PER_MINUTE)
+_token_bucket = TokenBucket(settings.LLM_TOKENS_PER_MINUTE)
+
+# asyncio primitives are bound to the loop they are first used on
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    # A semaphore that was waited on references its loop, so the weak key alone would not expire
+    for closed in [other for other in _semaphores if other.is_closed()]:
+        _semaphores.pop(closed, None)
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+    return _semaphores[loop]
+
+
+def _estimate_tokens(prompt: str) -> int:
+    # Prompt tokens plus headroom for the JSON answer
+    return count_tokens(SYSTEM_PROMPT + "\n" + prompt) + settings.LLM_EXPECTED_OUTPUT_TOKENS
+
+
+def _rate_limit_wait(prompt: str) -> float:
+    return max(
+        _request_bucket.reserve(1),
+        _token_bucket.reserve(_estimate_tokens(prompt)),
+    )
+
+
+# ========================
+# RETRIES
+# ========================
+_RETRYABLE = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def _retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    Seconds to wait before the next attempt, or None if the error is not
+    worth retrying (bad request, auth, ...). Invalid JSON is retried.
+    """
+    retryable = isinstance(error, (_RETRYABLE, LLMError)) or (
+        isinstance(error, openai.APIStatusError) and error.status_code in (408, 409)
+    )
+    if not retryable:
+        return None
+
+    server_hint = _retry_after(error)
+    if server_hint is not None:
+        return min(server_hint, settings.LLM_MAX_BACKOFF)
+
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(settings.LLM_MAX_BACKOFF, 2 ** attempt))
+
+
+def _completion_kwargs(prompt: str) -> Dict[str, Any]:
+    return dict(
+        model=settings.LLM_MODEL, # Ensure model is gpt-3.5-turbo-1106 or newer for json_object
+        messages=[
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        temperature=0.2,
+        # ✅ CRITICAL: Forces the LLM to output valid JSON
+        response_format={ "type": "json_object" }
+    )
+
+
+# ========================
+# RESPONSE CACHE
+# ========================
+_response_cache: Optional[DiskCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> DiskCache:
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = DiskCache(
+                settings.LLM_CACHE_PATH,
+                max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+                table="llm_responses",
+                ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+            )
+        return _response_cache
+
+
+def _cache_key(kwargs: Dict[str, Any]) -> str:
+    """Content address of a request: model, temperature, response format and the full messages."""
+    prompt_hash = hashlib.sha256(
+        json.dumps(kwargs["messages"], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return f"{kwargs['model']}:{kwargs['temperature']}:{kwargs['response_format']['type']}:{prompt_hash}"
+
+
+def _cached_response(kwargs: Dict[str, Any], use_cache: Optional[bool]) -> Optional[Dict[str, Any]]:
+    if not _cache_enabled(use_cache):
+        return None
+    cached = get_response_cache().get(_cache_key(kwargs))
+    if cached is None:
+        return None
+    return json.loads(cached.decode("utf-8"))
+
+
+def _store_response(kwargs: Dict[str, Any], use_cache: Optional[bool], result: Dict[str, Any]):
+    if _cache_enabled(use_cache):
+        get_response_cache().set(_cache_key(kwargs), json.dumps(result).encode("utf-8"))
+
+
+def _cache_enabled(use_cache: Optional[bool]) -> bool:
+    return settings.LLM_CACHE_ENABLED if use_cache is None else use_cache
+
+
+def response_cache_stats() -> Dict[str, float]:
+    return get_response_cache().stats()
+
+
+def generate_json(prompt: str, max_retries: int = 3, use_cache: Optional[bool] = None) -> Dict[str, Any]:
     """
     Generic function to send a prompt to the LLM and expect a JSON response.
     This matches the call signature in your Burr workflow.
+    Identical requests are answered from the response cache; use_cache=False bypasses it.
     """
+    kwargs = _completion_kwargs(prompt)
+    cached = _cached_response(kwargs, use_cache)
+    if cached is not None:
+        print("  ✓ LLM response served from cache")
+        return cached
+
     last_error = None
 
     for attempt in range(1, max_retries + 1):
         try:
             print(f"  ⏳ LLM generation attempt {attempt}...")
 
-            # correct OpenAI v1.x syntax
-            response = _client.chat.completions.create( 
-                model=settings.LLM_MODEL, # Ensure model is gpt-3.5-turbo-1106 or newer for json_object
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are a helpful assistant. Output valid JSON only."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                temperature=0.2,
-                # ✅ CRITICAL: Forces the LLM to output valid JSON
-                response_format={ "type": "json_object" } 
-            )
+            time.sleep(_rate_limit_wait(prompt))
+            response = _client.chat.completions.create(**kwargs)
 
             content = response.choices[0].message.content
             print("  ✓ LLM generation successful")
-            
-            return _safe_parse_json(content)
+
+            result = _safe_parse_json(content)
+            _store_response(kwargs, use_cache, result)
+            return result
 
         except Exception as e:
             print(f"  ⚠️ Attempt {attempt} failed: {e}")
             last_error = e
-            time.sleep(2 * attempt) # Exponential backoff
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                break
+            if attempt < max_retries:
+                time.sleep(delay)
 
-    raise LLMError(f"LLM generation failed after {max_retries} attempts: {last_error}")
+    raise LLMError(f"LLM generation failed after {attempt} attempts: {last_error}")
+
+
+async def agenerate_json(prompt: str, max_retries: int = 3, use_cache: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Async variant of generate_json. Concurrency is capped by a shared
+    semaphore (LLM_MAX_CONCURRENCY) and requests/tokens per minute by the
+    same buckets the sync client uses. Shares the response cache.
+    """
+    kwargs = _completion_kwargs(prompt)
+    cached = _cached_response(kwargs, use_cache)
+    if cached is not None:
+        return cached
+
+    last_error = None
+
+    for attempt in range(1, max_retries + 1):
+        try:
+            await asyncio.sleep(_rate_limit_wait(prompt))
+            async with _get_semaphore():
+                response = await _async_client.chat.completions.create(**kwargs)
+
+            result = _safe_parse_json(response.choices[0].message.content)
+            _store_response(kwargs, use_cache, result)
+            return result
+
+        except Exception as e:
+            print(f"  ⚠️ Attempt {attempt} failed: {e}")
+            last_error = e
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                break
+            if attempt < max_retries:
+                await asyncio.sleep(delay)
+
+    raise LLMError(f"LLM generation failed after {attempt} attempts: {last_error}")
 
 
 def _safe_parse_json(text: str) -> Dict[str, Any]:
@@ -61,7 +286,7 @@ def _safe_parse_json(text: str) -> Dict[str, Any]:
         # Remove markdown code blocks if present (e.g. ```json ... ```)
         if cleaned_text.startswith("```"):
             cleaned_text = cleaned_text.strip("`").replace("json", "").strip()
-        
+
         return json.loads(cleaned_text)
     except json.JSONDecodeError:
-        raise LLMError(f"Invalid JSON returned by LLM:\n{text}")
\ No newline at end of file
+        raise LLMError(f"Invalid JSON returned by LLM:\n{text}")
@@ -1,27 +1,109 @@
 from burr_workflow import build_burr_app
-from database import PRMetadata,get_session
-from typing import Optional
-from ingestion.github_api import fetch_pull_requests, fetch_pr_files,fetch_raw_file
-from ingestion.ingestion import run_ingestion
+from database import (
+    PRMetadata, GitHubETag, session_scope,
+    upsert_pr_metadata, upsert_etags, existing_blob_shas, replace_pr_files,
+)
+from sqlalchemy import func
+from typing import Optional, List, Dict, Any
+import hashlib
+from contextlib import nullcontext
+from ingestion.github_api import fetch_pull_requests, fetch_pr_files, fetch_raw_file, parse_github_time, ETagCache
+from ingestion.ingestion import ingest_repos, configured_repos
 from config import settings
 
 
+def compute_pr_fingerprint(head_sha: Optional[str], files: List[Dict[str, Any]]) -> str:
+    """
+    Identifies the exact revision of a PR: head commit + the patch of every file.
+    A report built from the same fingerprint never needs regenerating.
+    """
+    h = hashlib.sha256((head_sha or "").encode())
+    for f in sorted(files, key=lambda f: f["filename"]):
+        h.update(f"\0{f['filename']}\0{f['status']}\0{f.get('patch') or ''}".encode())
+    return h.hexdigest()
+
+
+def load_etags(db) -> ETagCache:
+    return {row.request_key: (row.etag, row.last_modified) for row in db.query(GitHubETag)}
+
+
 def ingest_prs(
     github_repo: str,
     github_token: Optional[str] = None,
-    db = None
+    db = None,
+    full_sync: bool = False,
 ):
     """
     Ingest PRs including metadata, diffs, and file stats.
+
+    Incremental: PRs (open and closed) are listed most-recently-updated first
+    and paging stops at the last sync's high-water mark. Closed PRs only
+    update rows we already have. List requests are conditional (ETag), and a
+    PR whose head SHA did not move skips its file / content downloads entirely.
+    full_sync=True re-downloads everything.
+
+    All rows are written at the end with batched INSERT ... ON CONFLICT in a
+    single transaction. Without a `db`, short sessions are used, so no pooled
+    connection sits idle in a transaction while GitHub is queried.
     """
-    prs = fetch_pull_requests(github_repo, github_token)
-    stored = []
+    scope = (lambda: nullcontext(db)) if db is not None else session_scope
+
+    with scope() as session:
+        etags = {} if full_sync else load_etags(session)
+        since = None
+        if not full_sync:
+            since = session.query(func.max(PRMetadata.updated_at)).filter(PRMetadata.repo == github_repo).scalar()
+
+        stored_prs = {
+            number for (number,) in
+            session.query(PRMetadata.pr_number).filter(PRMetadata.repo == github_repo)
+        }
+
+        # head SHA of every PR we already have, in one query
+        known_heads = dict(
+            session.query(PRMetadata.pr_number, PRMetadata.head_sha)
+            .filter(PRMetadata.repo == github_repo, PRMetadata.fingerprint.isnot(None))
+        )
+
+    # state=all: closing / merging a PR bumps updated_at, so the row's state follows
+    prs = fetch_pull_requests(github_repo, github_token, state="all", since=since, etags=etags)
+    print(f"🔹 {len(prs)} PR(s) updated since {since or 'the beginning'}")
+
+    # Closed PRs we never stored are history, not worth downloading
+    prs = [pr for pr in prs if pr.get("state") == "open" or pr["number"] in stored_prs]
+
+    rows = []
+    unchanged = []
+    files_by_pr_number = {}
+    raw_urls = {}  # blob SHA -> raw_url, for contents we may still need
     
     for pr in prs:
         pr_number = pr["number"]
+        head_sha = pr.get("head", {}).get("sha")
+        updated_at = parse_github_time(pr.get("updated_at"))
+        known = pr_number in known_heads
+
+        # Only metadata moved (comments, labels, title...): no file requests needed
+        if known and not full_sync and known_heads[pr_number] == head_sha:
+            rows.append({
+                "repo": github_repo, "pr_number": pr_number, "title": pr["title"],
+                "state": pr.get("state"), "updated_at": updated_at,
+            })
+            unchanged.append(pr_number)
+            continue
         
         # 1. Fetch the list of files for this PR
-        files = fetch_pr_files(github_repo, pr_number, github_token)
+        files = fetch_pr_files(github_repo, pr_number, github_token, etags=etags)
+        if files is None:
+            if known:
+                rows.append({
+                    "repo": github_repo, "pr_number": pr_number, "title": pr["title"],
+                    "state": pr.get("state"), "updated_at": updated_at, "head_sha": head_sha,
+                })
+                unchanged.append(pr_number)
+                continue
+            # Stale validator for a PR we no longer have: fetch unconditionally
+            files = fetch_pr_files(github_repo, pr_number, github_token)
         pr_files_data = []
 
         for f in files:
@@ -29,13 +111,10 @@ def ingest_prs(
             if f["status"] == "removed":
                 continue
 
-            # 3. (Optional) Fetch full content if you need context the Vector DB doesn't have
-            content = None
-            if f.get("raw_url"):
-                try:
-                    content = fetch_raw_file(f["raw_url"], github_token)
-                except Exception as e:
-                    print(f"Warning: Could not fetch content for {f['filename']}: {e}")
+            # 3. Remember where the full content lives; downloaded below only
+            #    for blobs we have not stored yet
+            if f.get("sha") and f.get("raw_url"):
+                raw_urls[f["sha"]] = f["raw_url"]
             
             # 4. BUILD THE RICH OBJECT (This is the most important change)
             # You must store the 'patch' to generate snippets later.
@@ -45,38 +124,66 @@ def ingest_prs(
                 "additions": f["additions"],  # For the "+X" stat
                 "deletions": f["deletions"],  # For the "-Y" stat
                 "patch": f.get("patch"),      # ✅ CRITICAL: The raw Diff text
-                "content": content            # ✅ FULL CONTEXT (Optional but good)
+                "blob_sha": f.get("sha"),     # Key into file_contents
             }
             pr_files_data.append(file_entry)
 
-        # 5. Create the DB Record
-        # Ensure your 'files' column in the DB is JSON/JSONB type!
-        pr_row = PRMetadata(
-            pr_number=pr_number,
-            url=pr["html_url"],
-            title=pr["title"],
-            author=pr["user"]["login"],
-            created_at=pr["created_at"],
-            # Store the list of dictionaries, not just strings
-            files=pr_files_data,  
-            repo=github_repo
-        )
+        files_by_pr_number[pr_number] = pr_files_data
+
+        # 5. Collect the DB row (written in bulk below)
+        rows.append({
+            "pr_number": pr_number,
+            "url": pr["html_url"],
+            "title": pr["title"],
+            "author": pr["user"]["login"],
+            "created_at": pr["created_at"],
+            "updated_at": updated_at,
+            "state": pr.get("state"),
+            "head_sha": head_sha,
+            "fingerprint": compute_pr_fingerprint(head_sha, pr_files_data),
+            "repo": github_repo,
+        })
+
+    # 6. Full contents, once per blob SHA across all PRs and past syncs
+    with scope() as session:
+        stored_blobs = existing_blob_shas(session, raw_urls)
+    contents = {}
+    for sha in set(raw_urls) - stored_blobs:
+        try:
+            contents[sha] = fetch_raw_file(raw_urls[sha], github_token)
+        except Exception as e:
+            print(f"Warning: Could not fetch content for blob {sha}: {e}")
+    # Only point pr_files at blobs that are actually stored
+    stored_blobs |= set(contents)
+    for files in files_by_pr_number.values():
+        for f in files:
+            if f["blob_sha"] not in stored_blobs:
+                f["blob_sha"] = None
 
-        # Upsert logic (check if exists first to avoid duplicates)
-        existing = db.query(PRMetadata).filter_by(pr_number=pr_number, repo=github_repo).first()
-        if not existing:
-            db.add(pr_row)
-            stored.append(pr_number)
-        else:
-            # Update existing record if needed
-            existing.files = pr_files_data
-            
-        db.commit()
+    # 7. One transaction: upsert every PR and its files, then remember the
+    # validators (only once every page they cover was processed)
+    with scope() as session:
+        try:
+            upserted = upsert_pr_metadata(session, rows)
+            ids = {r.pr_number: r.id for r in upserted}
+            replace_pr_files(
+                session,
+                {ids[number]: files for number, files in files_by_pr_number.items()},
+                contents,
+            )
+            upsert_etags(session, etags)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    stored = [r.pr_number for r in upserted if r.inserted]
 
     return {
         "status": "success", 
         "repo": github_repo, 
-        "prs_ingested": stored
+        "prs_ingested": stored,
+        "prs_unchanged": unchanged,
     }
 
 
@@ -102,27 +209,24 @@ if __name__ == "__main__":
             print("✅ Database initialized")
 
         elif choice == 1:
-            run_ingestion(
-                owner="exo-explore",
-                repo="exo",
-                branch="main",
-                token=settings.GITHUB_TOKEN  # ✅ secure
-            )
-            print("✅ Codebase ingestion completed")
+            full = input("Re-index every file instead of only changed ones? [y/N]: ").strip().lower() == "y"
+            results = ingest_repos(token=settings.GITHUB_TOKEN, full=full)  # ✅ secure
+            failed = [repo for repo, error in results.items() if error]
+            if failed:
+                print(f"⚠️ Codebase ingestion failed for: {', '.join(failed)}")
+            else:
+                print(f"✅ Codebase ingestion completed ({len(results)} repo(s))")
 
         elif choice == 2:
-            db_session = get_session()
-            try:
-                result = ingest_prs(
-                    github_repo="exo-explore/exo",
-                    github_token=settings.GITHUB_TOKEN,
-                    db=db_session
-                )
-                print(f"✅ PR ingestion complete -> {result}")
-            except Exception as e:
-                print(f"❌ Error during PR ingestion: {e}")
-            finally:
-                db_session.close()
+            for owner, repo, _ in configured_repos():
+                try:
+                    result = ingest_prs(
+                        github_repo=f"{owner}/{repo}",
+                        github_token=settings.GITHUB_TOKEN,
+                    )
+                    print(f"✅ PR ingestion complete -> {result}")
+                except Exception as e:
+                    print(f"❌ Error during PR ingestion of {owner}/{repo}: {e}")
 
         elif choice == 3:
             print("🚀 Starting Burr App...")
@@ -0,0 +1,423 @@
+import math
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+
+# ========================
+# TOKEN COUNTING
+# ========================
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """tiktoken encoding of `model`, or None when tiktoken / its BPE file is unavailable."""
+    try:
+        import tiktoken
+    except ImportError:
+        print("⚠️ tiktoken not installed, estimating tokens as chars / 4")
+        return None
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass  # unknown (e.g. local) model: use the current OpenAI encoding
+    except Exception as e:
+        print(f"⚠️ tiktoken encoding for {model} unavailable ({e}), estimating tokens as chars / 4")
+        return None
+
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"⚠️ tiktoken o200k_base unavailable ({e}), estimating tokens as chars / 4")
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    encoding = _encoding(model or settings.LLM_MODEL)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    # Diffs may contain strings like "<|endoftext|>"; count them as plain text
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# ========================
+# DIFF HUNKS
+# ========================
+_HUNK_HEADER = re.compile(r"^@@ ", re.M)
+
+# Files whose diffs say little about the change itself
+_LOW_SIGNAL = re.compile(r"(^|/)(package-lock\.json|yarn\.lock|pnpm-lock\.yaml|poetry\.lock|go\.sum|Cargo\.lock)$|\.lock$")
+_DOCS = re.compile(r"\.(md|rst|txt)$", re.I)
+_TESTS = re.compile(r"(^|/)(tests?|__tests__|spec)/|(^|/)test_[^/]*$|_test\.\w+$|\.(test|spec)\.\w+$")
+
+
+def file_weight(path: str) -> float:
+    """How much a file's diff is worth relative to source code."""
+    if _LOW_SIGNAL.search(path):
+        return 0.1
+    if _DOCS.search(path):
+        return 0.5
+    if _TESTS.search(path):
+        return 0.7
+    return 1.0
+
+
+def split_hunks(patch: str) -> List[str]:
+    """A unified diff patch cut at its "@@" headers."""
+    starts = [m.start() for m in _HUNK_HEADER.finditer(patch)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [patch[a:b].rstrip("\n") for a, b in zip(starts, starts[1:] + [len(patch)]) if patch[a:b].strip()]
+
+
+def _truncate(text: str, max_tokens: int) -> Tuple[str, int]:
+    """Keeps whole leading lines of `text` within max_tokens."""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text, tokens
+
+    lines = text.split("\n")
+    lo, hi = 0, len(lines)
+    while lo < hi:  # longest prefix of lines that fits
+        mid = (lo + hi + 1) // 2
+        if count_tokens("\n".join(lines[:mid])) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    kept = "\n".join(lines[:lo]) + f"\n... ({len(lines) - lo} more lines)"
+    return kept, count_tokens(kept)
+
+
+def rank_hunks(files: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Hunks of all files, best first: scored by weight * changed lines / sqrt(tokens), files taking turns."""
+    ranked = []
+    for index, f in enumerate(files):
+        weight = file_weight(f["filename"])
+        header_tokens = count_tokens(_file_header(f))
+        hunks = []
+        for position, text in enumerate(split_hunks(f.get("patch") or "")):
+            text, tokens = _truncate(text, settings.PROMPT_MAX_ITEM_TOKENS)
+            changed = sum(1 for line in text.split("\n")[1:] if line.startswith(("+", "-")))
+            hunks.append({
+                "file": index,
+                "position": position,
+                "text": text,
+                "tokens": tokens,
+                "score": weight * (changed + 1) / math.sqrt(tokens + 1),
+            })
+        hunks.sort(key=lambda h: -h["score"])
+        if hunks:
+            # The best hunk also pays for the file's header line
+            hunks[0]["tokens"] += header_tokens
+        ranked += [dict(h, turn=turn) for turn, h in enumerate(hunks)]
+
+    return sorted(ranked, key=lambda h: (h["turn"], -h["score"]))
+
+
+# ========================
+# CONTEXT CHUNKS
+# ========================
+def _lines(text: str) -> set:
+    return {line.strip() for line in text.split("\n") if line.strip()}
+
+
+def dedupe_chunks(chunks: List[Dict[str, Any]], overlap: float = 0.5) -> Tuple[List[Dict[str, Any]], int]:
+    """Drops chunks repeating, contained in or overlapping (by line share) a better ranked one; returns (kept, dropped)."""
+    kept, dropped = [], 0
+    for chunk in chunks:
+        text = " ".join(chunk["text"].split())
+        lines = _lines(chunk["text"])
+        for i, other in enumerate(kept):
+            if text in other["norm"]:
+                break
+            if other["norm"] in text:
+                kept[i] = dict(chunk, norm=text, lines=lines)
+                break
+            smaller = min(len(lines), len(other["lines"])) or 1
+            if len(lines & other["lines"]) / smaller > overlap:
+                break
+        else:
+            kept.append(dict(chunk, norm=text, lines=lines))
+            continue
+        dropped += 1
+
+    return [{k: v for k, v in c.items() if k not in ("norm", "lines")} for c in kept], dropped
+
+
+def rank_chunks(ctx: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], int]:
+    """Purpose and impact chunks alternating in retrieval order, deduplicated and sized."""
+    purpose = [dict(c, section="purpose") for c in ctx.get("file_context", [])]
+    impact = [dict(c, section="impact") for c in ctx.get("impact_context", [])]
+
+    interleaved = []
+    for i in range(max(len(purpose), len(impact))):
+        interleaved += purpose[i:i + 1] + impact[i:i + 1]
+
+    chunks, dropped = dedupe_chunks(interleaved)
+    for chunk in chunks:
+        body = f"### {chunk['file_path']}\n{chunk['text']}"
+        chunk["text"], chunk["tokens"] = _truncate(body, settings.PROMPT_MAX_ITEM_TOKENS)
+    return chunks, dropped
+
+
+# ========================
+# PACKING
+# ========================
+def _pack(items: List[Dict[str, Any]], budget: int) -> int:
+    """Greedily marks items (in rank order) as included while they fit; returns tokens used."""
+    used = 0
+    for item in items:
+        if item.get("included"):
+            continue
+        if used + item["tokens"] <= budget:
+            item["included"] = True
+            used += item["tokens"]
+    return used
+
+
+def _file_list(files: List[Dict[str, Any]], budget: int) -> str:
+    names, used = [], 0
+    for f in files:
+        used += count_tokens(f["filename"]) + 1
+        if used > budget:
+            break
+        names.append(f["filename"])
+    more = f" ... and {len(files) - len(names)} more" if len(names) < len(files) else ""
+    return ", ".join(names) + more
+
+
+def _file_header(f: Dict[str, Any]) -> str:
+    return f"### {f['filename']} ({f.get('status')}, +{f.get('additions') or 0}/-{f.get('deletions') or 0})"
+
+
+def _render_diffs(files: List[Dict[str, Any]], hunks: List[Dict[str, Any]], list_missing: bool = True) -> str:
+    by_file: Dict[int, List[Dict[str, Any]]] = {}
+    for h in hunks:
+        by_file.setdefault(h["file"], []).append(h)
+
+    parts, not_shown = [], []
+    for index, f in enumerate(files):
+        file_hunks = by_file.get(index, [])
+        included = sorted((h for h in file_hunks if h.get("included")), key=lambda h: h["position"])
+        if not included:
+            if list_missing:
+                not_shown.append(f["filename"])
+            continue
+        parts.append(_file_header(f))
+        parts += [h["text"] for h in included]
+        if len(included) < len(file_hunks):
+            parts.append(f"[{len(file_hunks) - len(included)} more hunk(s) not shown]")
+
+    if not_shown:
+        parts.append("Diffs not shown for: " + ", ".join(not_shown))
+    return "\n".join(parts)
+
+
+def _render_context(chunks: List[Dict[str, Any]], affected: List[Dict[str, Any]]) -> str:
+    parts = []
+    for section, title in (("purpose", "File purposes"), ("impact", "Code using the changed files")):
+        texts = [c["text"] for c in chunks if c["section"] == section and c.get("included")]
+        if texts:
+            parts += [f"## {title}", *texts]
+    if affected:
+        parts.append("## Affected files (import dependents, by depth)")
+        parts += [f"- {a['file_path']} (depth {a['depth']})" for a in affected]
+    return "\n".join(parts) or "(none found)"
+
+
+def _header(pr: Dict[str, Any], files: List[Dict[str, Any]], budget: int) -> str:
+    return (
+        "You are generating a PR report.\n\n"
+        f"METADATA:\nTitle: {pr['title']}\n"
+        f"Changes: {pr.get('stats', '')}\n"
+        f"Files Changed ({len(files)}): {_file_list(files, budget // 10)}\n"
+    )
+
+
+SUMMARY_TASK = (
+    'Return valid JSON with keys: "tldr" (list), "file_summaries" (list), '
+    '"impact" (string), "key_snippet" (string code block content).'
+)
+
+
+def build_summary_prompt(
+    pr: Dict[str, Any],
+    files: List[Dict[str, Any]],
+    ctx: Dict[str, Any],
+    budget: Optional[int] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """The summarize prompt for one PR packed to `budget` tokens (diff / context split by PROMPT_DIFF_SHARE); returns (prompt, usage)."""
+    budget = budget or settings.PROMPT_TOKEN_BUDGET
+    affected = ctx.get("affected_files", [])
+
+    header = _header(pr, files, budget)
+    fixed = count_tokens(header) + count_tokens(SUMMARY_TASK) + 20  # section labels
+
+    hunks = rank_hunks(files)
+    chunks, duplicates = rank_chunks(ctx)
+    affected_tokens = sum(count_tokens(a["file_path"]) + 6 for a in affected)
+
+    available = max(0, budget - fixed - affected_tokens)
+    diff_tokens = _pack(hunks, int(available * settings.PROMPT_DIFF_SHARE))
+    context_tokens = _pack(chunks, available - diff_tokens)
+    diff_tokens += _pack(hunks, available - diff_tokens - context_tokens)
+
+    prompt = (
+        f"{header}\n"
+        f"CONTEXT:\n{_render_context(chunks, affected)}\n\n"
+        f"CODE DIFFS:\n{_render_diffs(files, hunks)}\n\n"
+        f"TASK:\n{SUMMARY_TASK}\n"
+    )
+
+    usage = {
+        "tokens": count_tokens(prompt),
+        "budget": budget,
+        "diff_tokens": diff_tokens,
+        "diff_tokens_total": sum(h["tokens"] for h in hunks),
+        "context_tokens": context_tokens + affected_tokens,
+        "hunks": sum(1 for h in hunks if h.get("included")),
+        "hunks_total": len(hunks),
+        "chunks": sum(1 for c in chunks if c.get("included")),
+        "chunks_total": len(chunks),
+        "duplicate_chunks": duplicates,
+    }
+    return prompt, usage
+
+
+# ========================
+# MAP-REDUCE (PRs too large for one prompt)
+# ========================
+MAP_TASK = (
+    'Return valid JSON with keys: "file_summaries" (list of {"file": string, "summary": string}, '
+    'one per file above), "impact" (string: effects on code outside these files, or ""), '
+    '"key_snippet" (string: the most important changed code in this part, or "").'
+)
+
+REDUCE_TASK = (
+    'Merge the partial summaries into one report. Return valid JSON with keys: '
+    '"tldr" (list), "impact" (string), "key_snippet" (string code block content, '
+    'chosen from the candidates).'
+)
+
+
+def plan_map_groups(files: List[Dict[str, Any]]) -> Tuple[List[List[Dict[str, Any]]], List[str]]:
+    """At most SUMMARY_MAP_MAX_CALLS groups of best ranked, non-lockfile hunks; returns (groups, files with nothing summarised)."""
+    group_tokens = settings.SUMMARY_MAP_GROUP_TOKENS
+    hunks = [h for h in rank_hunks(files) if file_weight(files[h["file"]]["filename"]) > 0.1]
+
+    limit = group_tokens * settings.SUMMARY_MAP_MAX_CALLS
+    while True:
+        for h in hunks:
+            h.pop("included", None)
+        _pack(hunks, limit)
+
+        groups, current, used = [], [], 0
+        for h in sorted((h for h in hunks if h.get("included")), key=lambda h: (h["file"], h["position"])):
+            if current and used + h["tokens"] > group_tokens:
+                groups.append(current)
+                current, used = [], 0
+            current.append(h)
+            used += h["tokens"]
+        if current:
+            groups.append(current)
+
+        # Groups are not filled exactly; shrink until they fit the call limit
+        if len(groups) <= settings.SUMMARY_MAP_MAX_CALLS:
+            break
+        limit -= group_tokens // 4
+
+    covered = {h["file"] for group in groups for h in group}
+    skipped = [f["filename"] for i, f in enumerate(files) if i not in covered]
+    return groups, skipped
+
+
+def build_map_prompt(pr: Dict[str, Any], files: List[Dict[str, Any]], group: List[Dict[str, Any]], part: int, parts: int) -> str:
+    """Summarize prompt for one group; no retrieval context, so it stays small and cacheable."""
+    return (
+        f"You are summarizing part {part} of {parts} of a large PR.\n\n"
+        f"METADATA:\nTitle: {pr['title']}\n\n"
+        f"CODE DIFFS:\n{_render_diffs(files, group, list_missing=False)}\n\n"
+        f"TASK:\n{MAP_TASK}\n"
+    )
+
+
+def build_reduce_prompt(
+    pr: Dict[str, Any],
+    files: List[Dict[str, Any]],
+    ctx: Dict[str, Any],
+    file_summaries: List[Dict[str, str]],
+    partials: List[Dict[str, Any]],
+    budget: Optional[int] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """The merge prompt from the map calls' partial summaries, packed like build_summary_prompt; returns (prompt, usage)."""
+    budget = budget or settings.PROMPT_TOKEN_BUDGET
+    affected = ctx.get("affected_files", [])
+    header = _header(pr, files, budget)
+    fixed = count_tokens(header) + count_tokens(REDUCE_TASK) + 20
+
+    churn = {f["filename"]: (f.get("additions") or 0) + (f.get("deletions") or 0) for f in files}
+    def distinct(key):
+        return dict.fromkeys(p[key].strip() for p in partials if isinstance(p.get(key), str) and p[key].strip())
+
+    items = [
+        {"section": "impact", "text": f"- {impact}", "tokens": count_tokens(impact) + 2}
+        for impact in distinct("impact")
+    ]
+    items += [
+        {"section": "snippet", "text": f"```\n{snippet}\n```", "tokens": count_tokens(snippet) + 6}
+        for snippet in distinct("key_snippet")
+    ]
+    items += [
+        {"section": "files", "text": f"- {s['file']}: {s['summary']}", "tokens": count_tokens(s["file"] + s["summary"]) + 4}
+        for s in sorted(file_summaries, key=lambda s: -churn.get(s["file"], 0))
+    ]
+    chunks, duplicates = rank_chunks(ctx)
+    affected_tokens = sum(count_tokens(a["file_path"]) + 6 for a in affected)
+
+    available = max(0, budget - fixed - affected_tokens)
+    summary_tokens = _pack(items, int(available * settings.PROMPT_DIFF_SHARE))
+    context_tokens = _pack(chunks, available - summary_tokens)
+    summary_tokens += _pack(items, available - summary_tokens - context_tokens)
+
+    parts = []
+    for section, title in (("impact", "Impact noted per part"), ("snippet", "Key snippet candidates"), ("files", "File summaries")):
+        texts = [i["text"] for i in items if i["section"] == section and i.get("included")]
+        if texts:
+            parts += [f"## {title}", *texts]
+    omitted = sum(1 for i in items if i["section"] == "files" and not i.get("included"))
+    if omitted:
+        parts.append(f"[{omitted} more file summaries not shown]")
+
+    prompt = (
+        f"{header}\n"
+        f"CONTEXT:\n{_render_context(chunks, affected)}\n\n"
+        f"PARTIAL SUMMARIES:\n" + "\n".join(parts) + "\n\n"
+        f"TASK:\n{REDUCE_TASK}\n"
+    )
+
+    usage = {
+        "tokens": count_tokens(prompt),
+        "budget": budget,
+        "diff_tokens": summary_tokens,
+        "context_tokens": context_tokens + affected_tokens,
+        "hunks": 0,
+        "hunks_total": 0,
+        "chunks": sum(1 for c in chunks if c.get("included")),
+        "chunks_total": len(chunks),
+        "duplicate_chunks": duplicates,
+    }
+    return prompt, usage
+
+
+def format_usage(usage: Dict[str, Any]) -> str:
+    # In map-reduce mode the diff went to the map calls; the final prompt holds their summaries
+    diff = "partial summaries" if usage.get("map_calls") else "diff"
+    text = (
+        f"{usage['tokens']:,}/{usage['budget']:,} tokens "
+        f"({diff} {usage['diff_tokens']:,}: {usage['hunks']}/{usage['hunks_total']} hunks, "
+        f"context {usage['context_tokens']:,}: {usage['chunks']}/{usage['chunks_total']} chunks, "
+        f"{usage['duplicate_chunks']} duplicate(s) dropped)"
+    )
+    if usage.get("map_calls"):
+        text += f" + {usage['map_calls']} map call(s), {usage['map_tokens']:,} tokens"
+    return text
@@ -1,5 +1,5 @@
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 class ReportGenerator:
     def __init__(self, output_dir: str):
@@ -57,9 +57,12 @@ class ReportGenerator:
 ```"""
         return md_content
 
-    def save_file(self, pr_number: int, markdown_content: str) -> str:
+    def save_file(self, pr_number: int, markdown_content: str, repo: Optional[str] = None) -> str:
+        # PR numbers are only unique within a repo: reports/<owner>/<repo>/PR_<n>_Report.md
+        directory = os.path.join(self.output_dir, *repo.split("/")) if repo else self.output_dir
+        os.makedirs(directory, exist_ok=True)
         filename = f"PR_{pr_number}_Report.md"
-        file_path = os.path.join(self.output_dir, filename)
+        file_path = os.path.join(directory, filename)
         
         with open(file_path, "w", encoding="utf-8") as f:
             f.write(markdown_content)
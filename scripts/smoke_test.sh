@@ -41,7 +41,7 @@ export PYTHONPATH=$PROJECT_ROOT
 # 2️⃣ Clean Up Old Artifacts
 # ------------------------------------------------------------------------------
 echo -e "${YELLOW}[STEP 1] Cleaning up old artifacts...${NC}"
-rm -f "$REPORT_DIR/PR_${SMOKE_PR_NUMBER}_Report.md"
+rm -f "$REPORT_DIR/smoke-repo/PR_${SMOKE_PR_NUMBER}_Report.md"
 echo "  ✓ Removed old reports"
 
 # ------------------------------------------------------------------------------
@@ -52,7 +52,7 @@ echo -e "${YELLOW}[STEP 2] Generating test runner...${NC}"
 cat << 'EOF' > "$TEMP_TEST_FILE"
 import os
 import sys
-from database import get_session, init_db, PRMetadata, PRReport
+from database import get_session, init_db, PRMetadata, PRFile, PRReport
 from burr_workflow import build_burr_app
 from config import settings
 
@@ -79,13 +79,13 @@ def seed_db():
         author="script_bot",
         url="https://github.com/test/repo/pull/9999",
         repo="smoke-repo",
-        files=[{
-            "filename": "smoke_service.py",
-            "status": "modified",
-            "additions": 10,
-            "deletions": 2,
-            "patch": "@@ -1,5 +1,8 @@\n def check_status():\n-    return 'PENDING'\n+    return 'ACTIVE'"
-        }]
+        pr_files=[PRFile(
+            filename="smoke_service.py",
+            status="modified",
+            additions=10,
+            deletions=2,
+            patch="@@ -1,5 +1,8 @@\n def check_status():\n-    return 'PENDING'\n+    return 'ACTIVE'"
+        )]
     )
     db.add(dummy_pr)
     db.commit()
@@ -112,7 +112,7 @@ def verify():
     print(f"  ✅ PASS: Database record found (ID: {record.id})")
     
     # Check File
-    expected_path = os.path.join(settings.REPORTS_DIR, f"PR_{PR_NUMBER}_Report.md")
+    expected_path = os.path.join(settings.REPORTS_DIR, "smoke-repo", f"PR_{PR_NUMBER}_Report.md")
     
     if os.path.exists(expected_path):
         print(f"  ✅ PASS: Report file found at {expected_path}")
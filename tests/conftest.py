@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# The OpenAI clients are built at import time and refuse an empty key; no test calls the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import DiskCache  # noqa: E402
+from config import settings  # noqa: E402
+import llm_client  # noqa: E402
+
+
+@pytest.fixture
+def response_cache(tmp_path, monkeypatch):
+    """A fresh LLM response cache (the batch result channel) in a temp dir."""
+    cache = DiskCache(str(tmp_path / "llm.sqlite"), max_entries=1000, table="llm_responses")
+    monkeypatch.setattr(llm_client, "_response_cache", cache)
+    monkeypatch.setattr(settings, "LLM_CACHE_ENABLED", True)
+    return cache
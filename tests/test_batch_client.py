@@ -0,0 +1,94 @@
+import json
+import os
+
+import pytest
+
+import batch_client
+from batch_client import (
+    BatchCollector,
+    BatchPending,
+    BatchProvider,
+    LocalBatchProvider,
+    open_jobs,
+    submit_requests,
+    wait_and_collect,
+)
+from config import settings
+from llm_client import LLMError
+
+
+@pytest.fixture
+def batch_dir(tmp_path, monkeypatch, response_cache):
+    monkeypatch.setattr(settings, "LLM_BATCH_DIR", str(tmp_path / "batches"))
+    monkeypatch.setattr(settings, "LLM_BATCH_POLL_SECONDS", 0)
+    yield tmp_path / "batches"
+    batch_client.set_batch_provider(None)
+
+
+def answer(body):
+    prompt = body["messages"][-1]["content"]
+    if "broken" in prompt:
+        raise RuntimeError("model unavailable")
+    return json.dumps({"tldr": [prompt]})
+
+
+def test_provider_must_implement_the_job_methods():
+    with pytest.raises(TypeError):
+        BatchProvider()
+
+
+def test_submit_poll_resume(batch_dir):
+    provider = LocalBatchProvider(respond=answer)
+
+    # Round 1: nothing is answered yet, every prompt is queued
+    collector = BatchCollector()
+    for prompt in ("PR 1", "PR 2", "broken PR"):
+        with pytest.raises(BatchPending):
+            collector(prompt)
+    assert len(collector.pending) == 3
+
+    job_id = submit_requests(list(collector.pending.values()), provider)
+    # A run stopped here finds the job again instead of resubmitting
+    assert open_jobs(LocalBatchProvider(respond=answer)) == [job_id]
+
+    failed = wait_and_collect(job_id, provider)
+    assert len(failed) == 1
+    assert open_jobs(provider) == []
+
+    # Round 2: answers come back through the response cache, failures as LLMError
+    collector = BatchCollector(failed)
+    assert collector("PR 1") == {"tldr": ["PR 1"]}
+    assert collector("PR 2") == {"tldr": ["PR 2"]}
+    with pytest.raises(LLMError):
+        collector("broken PR")
+    assert collector.pending == {}
+
+
+def test_wait_gives_up_after_max_wait_and_leaves_the_job_open(batch_dir, monkeypatch):
+    class Slow(LocalBatchProvider):
+        def status(self, job_id):
+            return "in_progress"
+
+    provider = Slow(respond=answer)
+    monkeypatch.setattr(settings, "LLM_BATCH_MAX_WAIT_SECONDS", 0)
+    job_id = submit_requests([{"model": "m", "temperature": 0, "response_format": {"type": "json_object"},
+                               "messages": [{"role": "user", "content": "PR"}]}], provider)
+
+    with pytest.raises(TimeoutError):
+        wait_and_collect(job_id, provider)
+    assert open_jobs(provider) == [job_id]
+
+
+def test_job_with_missing_input_is_closed_with_its_requests_failed(batch_dir):
+    provider = LocalBatchProvider(respond=answer)
+    collector = BatchCollector()
+    with pytest.raises(BatchPending):
+        collector("PR 1")
+    job_id = submit_requests(list(collector.pending.values()), provider)
+    os.remove(batch_client.load_jobs()[job_id]["input"])
+
+    failed = wait_and_collect(job_id, provider)
+    assert len(failed) == 1
+    assert open_jobs(provider) == []
+    with pytest.raises(LLMError):
+        BatchCollector(failed)("PR 1")
@@ -0,0 +1,35 @@
+from llama_index.core import Document
+from llama_index.core.schema import TextNode
+
+from ingestion.dedup import ChunkDeduplicator
+
+BODY = " ".join(f"value_{i} = compute(value_{i - 1}, factor={i})" for i in range(1, 40))
+
+
+def node(path, text):
+    return TextNode(text=text, id_=f"{path}-0", metadata={"file_path": path})
+
+
+def test_exact_copy_of_a_near_duplicate_refers_to_the_kept_chunk():
+    dedup = ChunkDeduplicator(max_distance=6)
+    a = node("a.py", BODY)
+    b = node("b.py", BODY + " extra")  # near duplicate of a.py
+    c = node("c.py", BODY + " extra")  # exact copy of b.py
+
+    kept = dedup.filter([a, b, c])
+
+    assert [n.node_id for n in kept] == [a.node_id]
+    assert dedup.references({"a.py": [a.node_id]}) == {"b.py": [a.node_id], "c.py": [a.node_id]}
+
+
+def test_duplicate_file_refers_to_everything_its_original_uses():
+    dedup = ChunkDeduplicator(max_distance=6)
+    a = node("a.py", BODY)
+    b = node("b.py", BODY + " extra")
+    dedup.filter([a, b])
+
+    assert not dedup.is_duplicate_file(Document(text="x", metadata={"file_path": "b.py", "blob_sha": "1"}))
+    assert dedup.is_duplicate_file(Document(text="x", metadata={"file_path": "d.py", "blob_sha": "1"}))
+
+    refs = dedup.references({"a.py": [a.node_id]})
+    assert refs["d.py"] == [a.node_id]
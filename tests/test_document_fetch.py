@@ -0,0 +1,101 @@
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pytest
+
+from config import settings
+from ingestion import document, github_api
+
+
+class GitHubStandIn(BaseHTTPRequestHandler):
+    """Contents API: every file is `# <path>`; the first request is rate limited, missing.py is a 404."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive, so the pooled session can reuse connections
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse(self.path).path.split("/contents/", 1)[1]
+        with server.lock:
+            server.requests.append((path, time.time(), self.client_address[1]))
+            limited = not server.limited
+            server.limited = True
+
+        if limited:
+            self._reply(403, {"message": "API rate limit exceeded"}, {
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset": str(server.reset_at),
+            })
+        elif path == "src/missing.py":
+            self._reply(404, {"message": "Not Found"})
+        else:
+            content = base64.b64encode(f"# {path} ✓".encode("utf-8")).decode()
+            self._reply(200, {"content": content, "encoding": "base64"})
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in {"Content-Type": "application/json", "Content-Length": str(len(data)), **(headers or {})}.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def github(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GitHubStandIn)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.limited = False
+    server.reset_at = int(time.time()) + 2
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(settings, "GITHUB_API", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(github_api, "_session", None)
+    monkeypatch.setattr(github_api, "_pause_until", 0.0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def tree(n):
+    return [{"path": f"src/m{i}.py", "type": "blob", "sha": f"sha{i}"} for i in range(n)] + [
+        {"path": "README.md", "type": "blob", "sha": "readme"},
+        {"path": "src", "type": "tree", "sha": "dir"},
+    ]
+
+
+def test_rate_limit_pauses_every_worker_then_retries(github):
+    docs = list(document.iter_documents("o", "r", tree(12), token=None, concurrency=4, ref="abc"))
+
+    assert sorted(d.metadata["file_path"] for d in docs) == sorted(f"src/m{i}.py" for i in range(12))
+    assert {d.metadata["file_path"]: d.text for d in docs}["src/m3.py"] == "# src/m3.py ✓"
+    assert all(d.metadata["commit"] == "abc" and d.metadata["repo"] == "o/r" for d in docs)
+
+    # The rate-limited file was asked for again, and only once the limit reset
+    limited_path, limited_at, _ = github.requests[0]
+    retries = [at for path, at, _ in github.requests[1:] if path == limited_path]
+    assert len(retries) == 1 and retries[0] >= github.reset_at - 0.05
+    assert len(github.requests) == 13
+
+    # Requests sent after the 403 waited for the shared pause, not just the one that hit it
+    late = [at for _, at, _ in github.requests if at > limited_at + 0.5]
+    assert len(late) >= 12 - 4
+    assert min(late) >= github.reset_at - 0.05
+
+    # Pooled keep-alive session: no more connections than workers
+    assert len({port for _, _, port in github.requests}) <= 4
+
+
+def test_failed_file_is_skipped(github):
+    github.limited = True
+    items = tree(3) + [{"path": "src/missing.py", "type": "blob", "sha": "gone"}]
+    docs = document.build_documents("o", "r", items, token=None, concurrency=2)
+
+    assert sorted(d.metadata["file_path"] for d in docs) == [f"src/m{i}.py" for i in range(3)]
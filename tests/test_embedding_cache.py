@@ -0,0 +1,41 @@
+from llama_index.embeddings.openai import OpenAIEmbedding
+from pydantic import Field
+
+from cache import DiskCache
+from embedding_cache import CachedEmbedding, get_query_embeddings
+
+
+class RecordingOpenAI(OpenAIEmbedding):
+    """OpenAIEmbedding with the HTTP calls replaced; records what would have been sent."""
+
+    calls: list = Field(default_factory=list)
+
+    def _get_text_embeddings(self, texts):
+        self.calls.append(("texts", list(texts)))
+        return [[1.0, 0.0] for _ in texts]
+
+    def _get_query_embedding(self, query):
+        self.calls.append(("query", query))
+        return [0.0, 1.0]
+
+
+def cached_model(tmp_path):
+    inner = RecordingOpenAI(api_key="test", model="text-embedding-3-small")
+    return inner, CachedEmbedding(inner, DiskCache(str(tmp_path / "emb.sqlite"), max_entries=100, table="embeddings"))
+
+
+def test_uncached_queries_of_a_symmetric_model_go_out_in_one_batch(tmp_path):
+    inner, model = cached_model(tmp_path)
+
+    assert len(get_query_embeddings(model, ["a", "b", "c"])) == 3
+    assert len(get_query_embeddings(model, ["a", "d"])) == 2
+    assert inner.calls == [("texts", ["a", "b", "c"]), ("texts", ["d"])]
+
+
+def test_query_and_text_embeddings_are_cached_apart(tmp_path):
+    inner, model = cached_model(tmp_path)
+
+    assert model.get_text_embedding("a") == [1.0, 0.0]
+    assert model.get_query_embedding("a") == [0.0, 1.0]
+    assert model.get_text_embedding("a") == [1.0, 0.0]
+    assert inner.calls == [("texts", ["a"]), ("query", "a")]
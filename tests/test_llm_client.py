@@ -0,0 +1,146 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from openai import AsyncOpenAI
+
+import llm_client
+from config import settings
+from llm_client import LLMError, TokenBucket, agenerate_json
+
+
+class OpenAIStandIn(BaseHTTPRequestHandler):
+    """
+    /chat/completions of an OpenAI-compatible server. Answers with the
+    scripted (status, headers, content) replies in order, repeating the last.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.calls.append(time.time())
+            server.in_flight += 1
+            server.peak = max(server.peak, server.in_flight)
+            status, headers, content = server.replies.pop(0) if len(server.replies) > 1 else server.replies[0]
+        time.sleep(server.delay)
+
+        if status == 200:
+            body = {
+                "id": "chatcmpl-test",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "test",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+            }
+        else:
+            body = {"error": {"message": content, "type": "test", "code": str(status)}}
+        data = json.dumps(body).encode()
+
+        with server.lock:
+            server.in_flight -= 1
+        self.send_response(status)
+        for name, value in {"Content-Type": "application/json", "Content-Length": str(len(data)), **headers}.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def openai_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenAIStandIn)
+    server.lock = threading.Lock()
+    server.calls, server.in_flight, server.peak, server.delay = [], 0, 0, 0.0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def script(replies, delay=0.0):
+        server.replies = list(replies)
+        server.delay = delay
+        return server
+
+    # Built the way llm_client builds its client from OPENAI_BASE_URL at import
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setattr(llm_client, "_async_client", AsyncOpenAI(
+        api_key="test",
+        base_url=settings.OPENAI_BASE_URL,
+        max_retries=0,
+    ))
+    monkeypatch.setattr(llm_client, "_rate_limit_wait", lambda prompt: 0.0)
+    monkeypatch.setattr(settings, "LLM_MAX_BACKOFF", 0)
+    yield script
+    server.shutdown()
+    server.server_close()
+
+
+def ok(content):
+    return 200, {}, json.dumps(content)
+
+
+def test_token_bucket_books_ahead():
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+    assert TokenBucket(0).reserve(1000) == 0
+
+
+def test_concurrency_is_capped(openai_server, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_CONCURRENCY", 3)
+    server = openai_server([ok({"ok": True})], delay=0.05)
+
+    async def run():
+        return await asyncio.gather(*(agenerate_json(f"prompt {i}", use_cache=False) for i in range(10)))
+
+    assert asyncio.run(run()) == [{"ok": True}] * 10
+    assert server.peak == 3
+
+
+def test_semaphores_follow_their_event_loop():
+    async def semaphore():
+        return llm_client._get_semaphore()
+
+    first, second = asyncio.run(semaphore()), asyncio.run(semaphore())
+    assert first is not second
+    # Semaphores of closed loops are dropped, so the map only holds the running loop
+    async def tracked():
+        llm_client._get_semaphore()
+        return len(llm_client._semaphores)
+
+    assert asyncio.run(tracked()) == 1
+
+
+def test_rate_limit_waits_for_retry_after(openai_server, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_BACKOFF", 60)
+    server = openai_server([(429, {"retry-after": "1"}, "Rate limit reached"), ok({"ok": True})])
+
+    assert asyncio.run(agenerate_json("prompt", use_cache=False)) == {"ok": True}
+    assert len(server.calls) == 2
+    assert server.calls[1] - server.calls[0] >= 0.95
+
+
+def test_invalid_json_is_retried(openai_server):
+    server = openai_server([(200, {}, "not json"), ok({"ok": True})])
+    assert asyncio.run(agenerate_json("prompt", use_cache=False)) == {"ok": True}
+    assert len(server.calls) == 2
+
+
+def test_client_errors_are_not_retried(openai_server):
+    server = openai_server([(400, {}, "bad request")])
+    with pytest.raises(LLMError):
+        asyncio.run(agenerate_json("prompt", max_retries=3, use_cache=False))
+    assert len(server.calls) == 1
+
+
+def test_answers_are_shared_through_the_response_cache(openai_server, response_cache):
+    server = openai_server([ok({"ok": True})])
+    assert asyncio.run(agenerate_json("prompt")) == {"ok": True}
+    assert asyncio.run(agenerate_json("prompt")) == {"ok": True}
+    assert len(server.calls) == 1
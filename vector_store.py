@@ -1,28 +1,64 @@
+import re
+import threading
+
 from qdrant_client import QdrantClient
 from llama_index.vector_stores.qdrant import QdrantVectorStore
-from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.core import VectorStoreIndex, StorageContext, Document
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.retrievers import VectorIndexRetriever
 from config import settings
+from embeddings import get_embed_model
+from embedding_cache import get_query_embeddings
 from llama_index.core.vector_stores import MetadataFilters, ExactMatchFilter
-from qdrant_client.models import PointStruct, VectorParams,Distance
+from llama_index.core.schema import NodeWithScore
+from qdrant_client.models import PointStruct, VectorParams,Distance, PointIdsList
+from qdrant_client.models import Filter, FieldCondition, FilterSelector, MatchValue, QueryRequest
+from qdrant_client.models import (
+    BinaryQuantization, BinaryQuantizationConfig, HnswConfigDiff, KeywordIndexParams,
+    KeywordIndexType, PayloadSchemaType,
+    QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    SearchParams,
+)
+
+# Output sizes of the OpenAI embedding models (saves a probe request)
+KNOWN_EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def collection_name(repo: str | None = None) -> str:
+    """Collection holding `repo`'s chunks: the shared one, or one per repo with QDRANT_TENANCY="collection"."""
+    if repo and settings.QDRANT_TENANCY == "collection":
+        return f"{settings.QDRANT_COLLECTION}--{re.sub(r'[^A-Za-z0-9_-]', '_', repo)}"
+    return settings.QDRANT_COLLECTION
 
 
 class VectorStore:
-    def __init__(self):
+    """
+    Qdrant access for one repo (or, with repo=None, the shared collection).
+    Searches are scoped to `repo` unless another repo is passed explicitly.
+    """
+
+    def __init__(self, repo: str | None = None):
+        self.repo = repo
+        self.collection_name = collection_name(repo)
         self.client = QdrantClient(url=settings.QDRANT_URL)
-        self.vector_store = QdrantVectorStore(
+        self.embed = get_embed_model()
+        self.vector_store = get_vector_store(
+            self.collection_name,
+            batch_size=settings.INGEST_UPSERT_BATCH_SIZE,
             client=self.client,
-            collection_name=settings.QDRANT_COLLECTION,
+            embed_model=self.embed,
         )
         self.storage = StorageContext.from_defaults(vector_store=self.vector_store)
-        self.embed = OpenAIEmbedding(
-            api_key=settings.OPENAI_API_KEY,
-            model=settings.EMBEDDING_MODEL,
-        )
         self.splitter = SentenceSplitter(chunk_size=1200, chunk_overlap=200)
 
+        self._lock = threading.RLock()
+        self._index: VectorStoreIndex | None = None
+        self._retrievers: dict = {}
+
     def index_documents(self, docs: list[Document]):
         VectorStoreIndex.from_documents(
             docs,
@@ -31,58 +67,296 @@ class VectorStore:
             node_parser=self.splitter,
         )
 
+    def delete_points(self, point_ids: list[str], batch_size: int = 1000):
+        for i in range(0, len(point_ids), batch_size):
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=PointIdsList(points=point_ids[i:i + batch_size]),
+            )
+
+    def delete_repo_points(self, repo: str | None = None):
+        """Deletes every point whose repo payload is `repo` (default: this store's repo)."""
+        repo = repo or self.repo
+        if not repo:
+            raise ValueError("delete_repo_points needs a repo")
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=FilterSelector(
+                filter=Filter(must=[FieldCondition(key="repo", match=MatchValue(value=repo))])
+            ),
+        )
+
+    @property
+    def index(self) -> VectorStoreIndex:
+        with self._lock:
+            if self._index is None:
+                self._index = VectorStoreIndex.from_vector_store(
+                    self.vector_store,
+                    embed_model=self.embed,
+                )
+            return self._index
+
+    def _filter_values(
+        self,
+        file_path: str | None = None,
+        repo: str | None = None,
+    ) -> dict:
+        # No commit filter: unchanged files keep the commit they were first indexed at,
+        # so matching one commit would only find the files that changed in it
+        values = {"repo": repo or self.repo, "file_path": file_path}
+        return {key: value for key, value in values.items() if value}
+
+    def _retriever(self, k: int, filter_values: dict) -> VectorIndexRetriever:
+        key = (k, tuple(sorted(filter_values.items())))
+        index = self.index
+
+        with self._lock:
+            retriever = self._retrievers.get(key)
+            if retriever is None:
+                filters = None
+                if filter_values:
+                    filters = MetadataFilters(
+                        filters=[
+                            ExactMatchFilter(key=field, value=value)
+                            for field, value in filter_values.items()
+                        ]
+                    )
+
+                retriever = VectorIndexRetriever(
+                    index=index,
+                    similarity_top_k=k,
+                    filters=filters,
+                )
+                self._retrievers[key] = retriever
+            return retriever
 
     def semantic_search(
         self,
         query: str,
         file_path: str | None = None,
         k: int = 6,
+        repo: str | None = None,
     ):
         """
         Semantic vector search with optional metadata filtering.
-        No LLM involved.
+        No LLM involved. The index and retriever are built once per filter set and reused.
         """
+        retriever = self._retriever(k, self._filter_values(file_path=file_path, repo=repo))
+        nodes = retriever.retrieve(query)
+        return nodes
 
-        index = VectorStoreIndex.from_vector_store(
-            self.vector_store,
-            embed_model=self.embed,
+    def semantic_search_many(
+        self,
+        queries: list[str],
+        file_path: str | None = None,
+        k: int = 6,
+        repo: str | None = None,
+    ) -> list[list[NodeWithScore]]:
+        """
+        Batch version of semantic_search: query embeddings (one call where the
+        model batches them) and one Qdrant round trip (query_batch_points).
+        Results are returned in the same order as `queries`.
+        """
+        if not queries:
+            return []
+
+        embeddings = get_query_embeddings(self.embed, queries)
+
+        filter_values = self._filter_values(file_path=file_path, repo=repo)
+        query_filter = None
+        if filter_values:
+            query_filter = Filter(must=[
+                FieldCondition(key=field, match=MatchValue(value=value))
+                for field, value in filter_values.items()
+            ])
+
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                QueryRequest(
+                    query=embedding,
+                    using=self.vector_store.dense_vector_name,
+                    filter=query_filter,
+                    params=search_params(),
+                    limit=k,
+                    with_payload=True,
+                )
+                for embedding in embeddings
+            ],
         )
 
-        filters = None
-        if file_path:
-            filters = MetadataFilters(
-                filters=[
-                    ExactMatchFilter(
-                        key="file_path",
-                        value=file_path,
-                    )
-                ]
-            )
+        results = []
+        for response in responses:
+            parsed = self.vector_store.parse_to_query_result(response.points)
+            results.append([
+                NodeWithScore(node=node, score=score)
+                for node, score in zip(parsed.nodes, parsed.similarities)
+            ])
+        return results
+
+
+_shared: dict[str | None, VectorStore] = {}
+_shared_lock = threading.Lock()
 
-        retriever = VectorIndexRetriever(
-            index=index,
-            similarity_top_k=k,
-            filters=filters,  
+
+def get_vector_store_service(repo: str | None = None) -> VectorStore:
+    """
+    Long-lived VectorStore per repo, shared by the whole process (one Qdrant
+    client, one embedding model, cached index/retrievers). Safe to call from threads.
+    """
+    with _shared_lock:
+        if repo not in _shared:
+            _shared[repo] = VectorStore(repo)
+        return _shared[repo]
+
+
+def _configured_dimension() -> int | None:
+    if settings.EMBEDDING_DIMENSION:
+        return settings.EMBEDDING_DIMENSION
+    if settings.EMBEDDING_BACKEND.lower() == "openai":
+        return KNOWN_EMBEDDING_DIMENSIONS.get(settings.EMBEDDING_MODEL)
+    return None
+
+
+def embedding_dimension(embed_model=None) -> int:
+    """
+    Vector size of the configured embedding model: EMBEDDING_DIMENSION if set,
+    the known size of an OpenAI model, the local model's own dimension, or
+    else the length of one probe embedding.
+    """
+    dimension = _configured_dimension()
+    if dimension:
+        return dimension
+    if embed_model is None:
+        raise ValueError("Unknown embedding dimension; set EMBEDDING_DIMENSION")
+
+    model = getattr(embed_model, "inner", embed_model)
+    if hasattr(model, "dimension"):
+        return model.dimension
+    return len(embed_model.get_text_embedding("dimension probe"))
+
+
+def _quantization_config():
+    mode = settings.QDRANT_QUANTIZATION.lower()
+    if mode == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
         )
+    if mode == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    if mode in ("", "none"):
+        return None
+    raise ValueError(f"Unknown QDRANT_QUANTIZATION: {settings.QDRANT_QUANTIZATION}")
 
-        nodes = retriever.retrieve(query)
-        return nodes
 
-# def get_vector_store(collection_name: str, batch_size: int):
-#     client = QdrantClient(url=settings.QDRANT_URL)
-
-#     # ✅ ENSURE COLLECTION EXISTS
-#     if not client.collection_exists(collection_name):
-#         client.create_collection(
-#             collection_name=collection_name,
-#             vectors_config=VectorParams(
-#                 size=settings.EMBEDDING_DIMENSION,  # REQUIRED
-#                 distance=Distance.COSINE,
-#             ),
-#         )
-
-#     return QdrantVectorStore(
-#         client=client,
-#         collection_name=collection_name,
-#         batch_size=batch_size,
-#     )
\ No newline at end of file
+def search_params() -> SearchParams | None:
+    """With quantization, search the compact vectors and re-score the top candidates with the originals."""
+    if _quantization_config() is None:
+        return None
+    return SearchParams(
+        quantization=QuantizationSearchParams(
+            rescore=True,
+            oversampling=settings.QDRANT_QUANTIZATION_OVERSAMPLING,
+        )
+    )
+
+
+def _partitioned() -> bool:
+    return settings.QDRANT_TENANCY == "payload"
+
+
+def _hnsw_config() -> HnswConfigDiff:
+    if _partitioned():
+        # No global graph; one per repo. Unfiltered searches fall back to a scan.
+        return HnswConfigDiff(
+            m=0,
+            payload_m=settings.QDRANT_HNSW_M,
+            ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT,
+        )
+    return HnswConfigDiff(
+        m=settings.QDRANT_HNSW_M,
+        ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT,
+    )
+
+
+def _payload_schema(field: str):
+    if field == "repo" and _partitioned():
+        return KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True)
+    return PayloadSchemaType.KEYWORD
+
+
+_collections_lock = threading.Lock()
+
+
+def ensure_collection(
+    client: QdrantClient,
+    collection_name: str,
+    vector_size: int | None = None,
+    embed_model=None,
+):
+    """Creates the collection from the embedding / QDRANT_* settings if missing and adds the payload indexes; thread-safe."""
+    with _collections_lock:
+        _ensure_collection(client, collection_name, vector_size, embed_model)
+
+
+def _ensure_collection(client: QdrantClient, collection_name: str, vector_size: int | None, embed_model):
+    if not client.collection_exists(collection_name):
+        vector_size = vector_size or embedding_dimension(embed_model)
+        quantization = _quantization_config()
+        print(
+            f"🔹 Creating Qdrant collection {collection_name} "
+            f"(size={vector_size}, {settings.QDRANT_DISTANCE}, quantization={settings.QDRANT_QUANTIZATION})"
+        )
+        # Unnamed vector: the layout QdrantVectorStore uses for dense-only collections
+        try:
+            client.create_collection(
+                collection_name=collection_name,
+                vectors_config=VectorParams(
+                    size=vector_size,
+                    distance=Distance(settings.QDRANT_DISTANCE),
+                    on_disk=quantization is not None,
+                ),
+                hnsw_config=_hnsw_config(),
+                quantization_config=quantization,
+            )
+        except Exception:
+            # Another process created it in the meantime ("already exists")
+            if not client.collection_exists(collection_name):
+                raise
+    elif vector_size or _configured_dimension() or embed_model is not None:
+        expected = vector_size or embedding_dimension(embed_model)
+        vectors = client.get_collection(collection_name).config.params.vectors
+        actual = [v.size for v in vectors.values()] if isinstance(vectors, dict) else [vectors.size]
+        if expected not in actual:
+            raise ValueError(
+                f"Collection {collection_name} holds vectors of size {actual}, "
+                f"but the {settings.EMBEDDING_BACKEND} embedding model produces {expected}; "
+                "use another QDRANT_COLLECTION when switching models"
+            )
+
+    existing = client.get_collection(collection_name).payload_schema or {}
+    for field in settings.QDRANT_PAYLOAD_INDEXES:
+        if field not in existing:
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field,
+                field_schema=_payload_schema(field),
+            )
+
+
+def get_vector_store(
+    collection_name: str,
+    batch_size: int,
+    client: QdrantClient | None = None,
+    embed_model=None,
+):
+    client = client or QdrantClient(url=settings.QDRANT_URL)
+
+    # Before QdrantVectorStore is built, so it detects the collection's vector layout
+    ensure_collection(client, collection_name, embed_model=embed_model)
+
+    return QdrantVectorStore(
+        client=client,
+        collection_name=collection_name,
+        batch_size=batch_size,
+    )